@@ -2,48 +2,107 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import functools
 import json
 import logging
 import sys
 import uuid
+from datetime import timedelta
 from logging import FileHandler, Formatter
 
 import babel
+import click
 import dateutil.parser
-from flask import (Flask, Response, flash, jsonify, redirect, render_template,
-                   request, url_for)
+from flask import (Flask, Response, flash, g, jsonify, redirect, render_template,
+                   request, stream_with_context, url_for)
 from flask_migrate import Migrate
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import Form
-from sqlalchemy.dialects.postgresql import UUID
-
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import object_session, selectinload
+
+from booking import BookingConflict, book_show, find_conflicts
+from cache import (FragmentCacheExtension, LRUCache, cache_stream, cached_view, create_cache,
+                   limit_response_ttl, versioned_key)
+from concurrent_queries import QueryExecutor
+from data_generator import generate_dataset
+from database import (GUID, FyyurSQLAlchemy, GUIDConverter, UTCDateTime, as_utc, init_replica_routing,
+                      init_request_time, parse_guid, read_only, request_now, utc_now)
 from forms import *
 from helper_functions import (error_logger, format_artist_data,
-                              format_artist_page_data, format_show_data,
-                              format_venue_page_data, get_future_shows_count,
-                              get_past_shows, get_past_shows_count, search_results_format,
-                              get_upcoming_shows, get_venue_data, seed_db)
+                              format_artist_page_data,
+                              format_venue_page_data, get_entity_counts, get_genre_id,
+                              get_page_cache_ttl, get_shows_data,
+                              get_venue_data, get_venues_with_upcoming_counts,
+                              invalidate_genre_cache, load_genre_cache,
+                              paginate_keyset, search_results_format, seed_db,
+                              stream_select_options)
+from instrumentation import init_instrumentation
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, init_metrics
+from partitions import (DEFAULT_PARTITION, add_months, archive_partitions, create_show_partitions,
+                        expired_partitions, is_partitioned, month_start, partition_entities)
+from search import count_search_results, search_entities
+from show_feed import ShowFeed, load_upcoming_shows
+from show_import import import_shows, read_csv_rows, read_csv_upload
+from show_stats import (rebuild_show_stats, record_show_added, record_show_removed,
+                        refresh_show_stats, roll_show_stats)
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
 app = Flask(__name__)
+app.url_map.converters['guid'] = GUIDConverter
+# One "now" per request, passed to every helper splitting shows into past and upcoming
+init_request_time(app)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+# one session per request, removed when the request ends, pool settings in database.py
+db = FyyurSQLAlchemy(app)
+# GET requests read from the replicas of DATABASE_REPLICA_URLS
+init_replica_routing(app)
 
 # DONE: connect to a local postgresql database
 migrate = Migrate(app, db)
+# Query counts and timings per request, see instrumentation.py
+init_instrumentation(app)
+
+# Rendered responses of the read routes, in the backend picked by CACHE_BACKEND
+response_cache = create_cache(app.config)
+# Venue and artist page view models, always held in process
+venue_page_cache = LRUCache(app.config['PAGE_CACHE_SIZE'])
+artist_page_cache = LRUCache(app.config['PAGE_CACHE_SIZE'])
+# Rendered listing tiles and rows, versioned by the namespaces of response_cache. Those versions are
+# per process by default, so fragments also expire to pick up writes of other processes and CLI commands.
+fragment_cache = LRUCache(app.config['FRAGMENT_CACHE_SIZE'], default_ttl=app.config['CACHE_LISTING_TTL'])
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = fragment_cache
+app.jinja_env.fragment_versions = response_cache
+# Runs the venue/artist page queries concurrently when DETAIL_QUERY_WORKERS is set
+detail_queries = QueryExecutor(app, app.config['DETAIL_QUERY_WORKERS'])
+# Upcoming shows listed on /shows, kept in memory and reloaded by a background thread
+show_feed = ShowFeed(app, lambda now: load_upcoming_shows(db, Show, Venue, Artist, now))
+# Time a show books its venue and artist for, overlapping bookings are rejected, see booking.py
+show_duration = timedelta(minutes=app.config['SHOW_DURATION_MINUTES'])
+# Prometheus metrics served on /metrics, see metrics.py
+metrics_registry = init_metrics(
+  app, db.named_engines,
+  {'response': response_cache, 'venue_page': venue_page_cache, 'artist_page': artist_page_cache,
+   'fragment': fragment_cache},
+  lambda: get_entity_counts(db, Show, Venue, Artist, utc_now()), app.config['METRICS_COUNTS_TTL'])
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
 class Venue(db.Model):
     __tablename__ = 'venue'
+    __table_args__ = (
+      db.Index('ix_venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+      db.Index('ix_venue_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
-    id = db.Column(db.String(120), primary_key=True)
+    id = db.Column(GUID, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
@@ -55,6 +114,8 @@ class Venue(db.Model):
     website= db.Column(db.String(120), default='www.example.com')
     seeking_talent = db.Column(db.Boolean,  nullable=False, default=False)
     seeking_description = db.Column(db.String(500))
+    # maintained by database triggers from name, city, state and genres, see search.py
+    search_vector = db.deferred(db.Column(TSVECTOR().with_variant(db.Text, 'sqlite')))
     shows = db.relationship('Show', backref='venue', lazy=True, cascade="all, delete, delete-orphan", passive_deletes=True)
     genres = db.relationship('Venue_Genre', backref='venue', lazy=True, cascade="all, delete, delete-orphan", passive_deletes=True)
     def __repr__(self):
@@ -62,8 +123,12 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'artist'
+    __table_args__ = (
+      db.Index('ix_artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+      db.Index('ix_artist_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
-    id = db.Column(db.String(120), primary_key=True)
+    id = db.Column(GUID, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
@@ -75,6 +140,8 @@ class Artist(db.Model):
     website = db.Column(db.String(500), default='www.example.com')
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(500))
+    # maintained by database triggers from name, city, state and genres, see search.py
+    search_vector = db.deferred(db.Column(TSVECTOR().with_variant(db.Text, 'sqlite')))
     shows = db.relationship('Show', backref='artist', lazy=True, cascade="all, delete, delete-orphan", passive_deletes=True)
     genres = db.relationship('Artist_Genre', backref='artist', lazy=True, cascade="all, delete, delete-orphan", passive_deletes=True)
     def __repr__(self):
@@ -83,10 +150,21 @@ class Artist(db.Model):
 # DONE Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 class Show(db.Model):
   __tablename__ = 'show'
-  
-  artist_id = db.Column(db.String, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True)
-  venue_id = db.Column(db.String, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True)
-  start_time = db.Column(db.DateTime, nullable=False, primary_key=True)
+  __table_args__ = (
+    db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_show_start_time', 'start_time'),
+    # monthly partitions, see partitions.py
+    {'postgresql_partition_by': 'RANGE (start_time)'},
+  )
+  artist_id = db.Column(GUID, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True)
+  venue_id = db.Column(GUID, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True)
+  start_time = db.Column(UTCDateTime, nullable=False, primary_key=True)
+
+# A partitioned table only takes rows its partitions cover, show_default covers them all until
+# `flask create-show-partitions` creates the month partitions
+event.listen(Show.__table__, 'after_create',
+             DDL('CREATE TABLE ' + DEFAULT_PARTITION + ' PARTITION OF show DEFAULT').execute_if(dialect='postgresql'))
 
 class Genre(db.Model):
   __tablename__ = 'genre'
@@ -100,20 +178,116 @@ class Genre(db.Model):
   
 class Venue_Genre(db.Model):
   __tablename__ = 'venue_genre'
-  
-  venue_id = db.Column(db.String, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True)
+  __table_args__ = (
+    db.Index('ix_venue_genre_genre', 'genre'),
+  )
+  venue_id = db.Column(GUID, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True)
   genre = db.Column(db.Integer, db.ForeignKey('genre.id'), primary_key=True)
   
 class Artist_Genre(db.Model):
   __tablename__ = 'artist_genre'
-  
-  artist_id = db.Column(db.String, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True)
+  __table_args__ = (
+    db.Index('ix_artist_genre_genre', 'genre'),
+  )
+  artist_id = db.Column(GUID, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True)
   genre = db.Column(db.Integer, db.ForeignKey('genre.id'), primary_key=True)
-  
+
+# Show counts and next/last show times of a venue or artist, see show_stats.py
+class Show_Stats(db.Model):
+  __tablename__ = 'show_stats'
+  __table_args__ = (
+    db.Index('ix_show_stats_next_show_time', 'next_show_time'),
+  )
+  entity_type = db.Column(db.String(6), primary_key=True)
+  entity_id = db.Column(GUID, primary_key=True)
+  upcoming_count = db.Column(db.Integer, nullable=False, default=0)
+  past_count = db.Column(db.Integer, nullable=False, default=0)
+  next_show_time = db.Column(UTCDateTime)
+  last_show_time = db.Column(UTCDateTime)
+
+# Cached responses and page view models are keyed by namespace versions, see cache.py.
+# Writes record the namespaces they touch and the versions are bumped once the session commits:
+#   venue / artist         any venue / artist row, their names show up on the other side's pages
+#   show                   any show row
+#   venue:<id> / artist:<id>  one venue / artist, its genres and its shows
+def invalidate_on_commit(target, *namespaces):
+  session = object_session(target)
+  session.info.setdefault('invalidated_namespaces', set()).update(namespaces)
+
+# Genres are served from an in-process cache, dropped once a write to the genre table commits, so
+# a request reloading it in between can't cache the rows of before the write
+@event.listens_for(Genre, 'after_insert')
+@event.listens_for(Genre, 'after_update')
+@event.listens_for(Genre, 'after_delete')
+def genre_written(mapper, connection, target):
+  object_session(target).info['genres_written'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def bump_invalidated_namespaces(session):
+  if session.info.pop('genres_written', False):
+    invalidate_genre_cache()
+  namespaces = session.info.pop('invalidated_namespaces', ())
+  for namespace in namespaces:
+    response_cache.bump_version(namespace)
+  # the feed lists show times and artist/venue names
+  if any(namespace in namespaces for namespace in ('show', 'venue', 'artist')):
+    show_feed.request_refresh()
+
+@event.listens_for(db.session, 'after_rollback')
+def drop_invalidated_namespaces(session):
+  session.info.pop('genres_written', None)
+  session.info.pop('invalidated_namespaces', None)
+
+@event.listens_for(Venue, 'after_insert')
+@event.listens_for(Venue, 'after_update')
+@event.listens_for(Venue, 'after_delete')
+def venue_written(mapper, connection, target):
+  invalidate_on_commit(target, 'venue', 'venue:' + str(target.id))
+
+@event.listens_for(Artist, 'after_insert')
+@event.listens_for(Artist, 'after_update')
+@event.listens_for(Artist, 'after_delete')
+def artist_written(mapper, connection, target):
+  invalidate_on_commit(target, 'artist', 'artist:' + str(target.id))
+
+@event.listens_for(Show, 'after_insert')
+@event.listens_for(Show, 'after_update')
+@event.listens_for(Show, 'after_delete')
+def show_written(mapper, connection, target):
+  invalidate_on_commit(target, 'show', 'venue:' + str(target.venue_id), 'artist:' + str(target.artist_id))
+
+# show_stats rows are written in the transaction of the show
+@event.listens_for(Show, 'after_insert')
+def show_inserted(mapper, connection, target):
+  record_show_added(connection, Show, Show_Stats, target, request_now())
+
+@event.listens_for(Show, 'after_delete')
+def show_deleted(mapper, connection, target):
+  record_show_removed(connection, Show, Show_Stats, target, request_now())
+
+@event.listens_for(Venue_Genre, 'after_insert')
+@event.listens_for(Venue_Genre, 'after_delete')
+def venue_genre_written(mapper, connection, target):
+  invalidate_on_commit(target, 'venue:' + str(target.venue_id))
+
+@event.listens_for(Artist_Genre, 'after_insert')
+@event.listens_for(Artist_Genre, 'after_delete')
+def artist_genre_written(mapper, connection, target):
+  invalidate_on_commit(target, 'artist:' + str(target.artist_id))
+
+# The namespaces each cached page depends on
+def venue_page_namespaces(venue_id):
+  return ['venue:' + venue_id, 'artist']
+
+def artist_page_namespaces(artist_id):
+  return ['artist:' + artist_id, 'venue']
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+# Listings format the same few datetimes over and over, results are remembered per (value, format)
+@functools.lru_cache(maxsize=app.config['DATETIME_FORMAT_CACHE_SIZE'])
 def format_datetime(value, format='medium'):
   if isinstance(value, str):
         date = dateutil.parser.parse(value)
@@ -136,32 +310,62 @@ def index():
   return render_template('pages/home.html')
 
 
+# Streams the select options of the new show form, answering 304 with no database
+# work when the client's copy matches the current version of the venue/artist namespace.
+# Complete bodies are kept in the response cache and served from there while they are current.
+# Only a shared cache sees the writes of every process: with a per-process one, versions go stale
+# when another process writes, so there are no ETags and bodies expire like the listings.
+def select_options_response(type, query):
+  etag = type + '-' + response_cache.version(type) if response_cache.shared else None
+  if etag is not None and request.if_none_match.contains(etag):
+    response = Response(status=304)
+  else:
+    key = versioned_key(response_cache, [type], 'select_options', type)
+    body = response_cache.get(key)
+    if body is None:
+      ttl = app.config['CACHE_SELECT_OPTIONS_TTL'] if response_cache.shared else app.config['CACHE_LISTING_TTL']
+      body = stream_with_context(cache_stream(response_cache, key, stream_select_options(query, type), ttl))
+    response = Response(body, mimetype='application/json')
+  if etag is not None:
+    response.set_etag(etag)
+  return response
+
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@cached_view(response_cache, lambda: ['venue', 'show'], lambda: app.config['CACHE_LISTING_TTL'])
 def venues():
   # DONE: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
+  data = []
+  next_cursor = None
   try:
-    venues = Venue.query.order_by(Venue.state).all()
+    venues, next_cursor = get_venues_with_upcoming_counts(db, Show, Venue, Show_Stats, g.now, request.args.get('cursor'),
+                                                          app.config['PAGE_SIZE'])
     data = get_venue_data(venues)
   except Exception as e:
     error_logger(e, 'Error in venue listing')
+    flash('Error loading venues')
   finally:
-    db.session.close()
-    return render_template('pages/venues.html', areas=data)
+    return render_template('pages/venues.html', areas=data, next_cursor=next_cursor)
 
 @app.route('/venues/search', methods=['POST'])
+@read_only
 def search_venues():
   # DONE: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
   search_term = request.form.get('search_term', '')
   try:
-    search_query = Venue.query.filter(Venue.name.ilike('%' + search_term + '%')).all()
-    result_data = search_results_format(db, Show, search_query, 'venue')
-    db.session.close()
+    search_query = search_entities(db, Venue, search_term, app.config['SEARCH_RESULTS_LIMIT'],
+                                   app.config['SEARCH_MATCH_LIMIT'])
+    # only a full page of results needs counting
+    count = None
+    if len(search_query) == app.config['SEARCH_RESULTS_LIMIT']:
+      count = count_search_results(db, Venue, search_term, app.config['SEARCH_MATCH_LIMIT'])
+    result_data = search_results_format(db, Show, Show_Stats, search_query, 'venue', g.now, count,
+                                        app.config['SEARCH_MATCH_LIMIT'])
     return render_template('pages/search_venues.html', results=result_data, search_term=search_term)
   except Exception as e:
     error_logger(e, 'Error searching venue')
@@ -169,52 +373,36 @@ def search_venues():
     return render_template('pages/search_venues.html', results={}, search_term=search_term)
     
 
-@app.route('/venues/<string:venue_id>')
+@app.route('/venues/all')
+def venue_options():
+  # Query all venues and return Venue list in JSON object to client requesting '/venues/all' endpoint
+  return select_options_response('venue', db.session.query(Venue.id, Venue.name).order_by(Venue.name))
+
+@app.route('/venues/<guid:venue_id>')
+@cached_view(response_cache, venue_page_namespaces, lambda: app.config['CACHE_DETAIL_TTL'])
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # DONE: replace with real venue data from the venues table, using venue_id
   # data = list(filter(lambda d: d['id'] == venue_id, [data1, data2, data3]))[0]
-   # Query all artists and return Artist list in JSON object to client requesting '/artists/all' endpoint
-  if venue_id == 'all':
-    error = False
-    try:
-      venues = Venue.query.all()
-    except Exception as e:
-      error_logger(e, 'Error fetching venues for select options')
-      error = True
-    finally:
-      if error:
-        return abort(400)
-      else:
-        body = {}
-        venues_list = []
-        body["venues_list"] = []
-        for venue in venues:
-          venue_obj = {
-            "venue_id": venue.id,
-            "venue_name": venue.name
-          }
-          venues_list.append(venue_obj)
-        body["venues_list"] = venues_list
-        return jsonify(body)
-
   error = False
   try:
-    venue = Venue.query.get(venue_id)
+    page_key = versioned_key(response_cache, venue_page_namespaces(venue_id), 'venue_page', venue_id)
+    venue_data = venue_page_cache.get(page_key)
+    if venue_data is None:
+      venue, shows_data = detail_queries.run(
+        lambda: Venue.query.options(selectinload(Venue.genres)).get(venue_id),
+        lambda: get_shows_data(db, Show, Venue, Artist, venue_id, 'venue', g.now))
+      future_shows, future_shows_count, past_shows, past_shows_count = shows_data
+      venue_data = format_venue_page_data(db, Genre, venue, future_shows, future_shows_count,
+                              past_shows, past_shows_count)
+      venue_page_cache.set(page_key, venue_data, get_page_cache_ttl(venue_data, app.config['PAGE_CACHE_TTL'], g.now))
+    # the rendered page too must not list a show that started as upcoming
+    limit_response_ttl(get_page_cache_ttl(venue_data, app.config['CACHE_DETAIL_TTL'], g.now))
   except Exception as e:
     error_logger(e, 'Error fetching venue ' + venue_id)
     error = True
   finally:
-    db.session.close()
     if not error:
-      future_shows = get_upcoming_shows(db, Show, Venue, Artist, venue_id, 'venue')
-      future_shows_count = get_future_shows_count(db, Show, venue_id, 'venue')
-      past_shows = get_past_shows(db, Show, Venue, Artist, venue_id, 'venue')
-      past_shows_count = get_past_shows_count(db, Show, venue_id, 'venue')
-
-      venue = Venue.query.get(venue_id)
-      venue_data = format_venue_page_data(db, Genre, venue, future_shows, future_shows_count, 
-                              past_shows, past_shows_count)
       return render_template('pages/show_venue.html', venue=venue_data)
     else:
       flash('Oops! An error occured while fetching the venue page')
@@ -248,7 +436,7 @@ def create_venue_submission():
     else:
       seeking_talent = False
     seeking_description = request.form['seeking_description']
-    v_id = uuid.uuid1()
+    v_id = str(uuid.uuid1())
     new_venue = Venue(id=v_id, 
                       name=name, 
                       city=city, 
@@ -261,8 +449,8 @@ def create_venue_submission():
                       seeking_description=seeking_description)
     db.session.add(new_venue)
     for genre in genres:
-      # get the id of the genre from the genre table in db
-      genre_id = Genre.query.filter_by(name=genre).first().id
+      # get the id of the genre from the genre cache
+      genre_id = get_genre_id(db, Genre, genre)
       # store the venue-genre combination in db
       new_genre = Venue_Genre(venue_id=v_id, genre=genre_id)
       db.session.add(new_genre)
@@ -272,7 +460,6 @@ def create_venue_submission():
     error = True
     db.session.rollback()
   finally:
-    db.session.close()
     # on successful db insert, flash success
     if error:
       message = 'There was an error listing the Venue'
@@ -285,20 +472,28 @@ def create_venue_submission():
     return render_template('pages/home.html')
     
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@app.route('/venues/<guid:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   # DONE: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   error = False
   try:
+    # bulk query deletes skip the mapper events, refresh the stats of the venue and of the artists
+    # of its cascaded shows, and invalidate them, by hand
+    artist_ids = [artist_id for (artist_id,) in db.session.query(Show.artist_id).filter_by(venue_id=venue_id).distinct()]
     Venue.query.filter_by(id=venue_id).delete()
+    connection = db.session.connection()
+    refresh_show_stats(connection, Show, Show_Stats, 'venue', [venue_id], g.now)
+    refresh_show_stats(connection, Show, Show_Stats, 'artist', artist_ids, g.now)
     db.session.commit()
+    for namespace in ('venue', 'venue:' + venue_id, 'show'):
+      response_cache.bump_version(namespace)
+    show_feed.request_refresh()
   except Exception as e:
     error_logger(e, 'Error in venue deletion')
     error = True
     db.session.rollback()
   finally:
-    db.session.close()
     if error:
       return jsonify({ 'success': False })
     else:
@@ -309,76 +504,70 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@cached_view(response_cache, lambda: ['artist'], lambda: app.config['CACHE_LISTING_TTL'])
 def artists():
   # DONE: replace with real data returned from querying the database
   error = False
   try:
-    artists = Artist.query.add_columns('id', 'name').all()
+    artists_query = db.session.query(Artist.id, Artist.name)
+    artists, next_cursor = paginate_keyset(artists_query, [Artist.name, Artist.id],
+                                           request.args.get('cursor'), app.config['PAGE_SIZE'])
     data = format_artist_data(artists)
   except Exception as e:
     error_logger(e, 'Error in artist listing')
     error = True
     db.session.rollback()
   finally:
-    db.session.close()
     if error:
-      return render_template('errors/500.html')
+      return render_template('errors/500.html'), 500
     else:
-      return render_template('pages/artists.html', artists=data)
+      return render_template('pages/artists.html', artists=data, next_cursor=next_cursor)
 
 @app.route('/artists/search', methods=['POST'])
+@read_only
 def search_artists():
   # DONE: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
   search_term = request.form.get('search_term', '')
   try:
-    search_query = Artist.query.filter(Artist.name.ilike('%' + search_term + '%')).all()
-    result_data = search_results_format(db, Show, search_query, 'artist')
-    db.session.close()
+    search_query = search_entities(db, Artist, search_term, app.config['SEARCH_RESULTS_LIMIT'],
+                                   app.config['SEARCH_MATCH_LIMIT'])
+    # only a full page of results needs counting
+    count = None
+    if len(search_query) == app.config['SEARCH_RESULTS_LIMIT']:
+      count = count_search_results(db, Artist, search_term, app.config['SEARCH_MATCH_LIMIT'])
+    result_data = search_results_format(db, Show, Show_Stats, search_query, 'artist', g.now, count,
+                                        app.config['SEARCH_MATCH_LIMIT'])
     return render_template('pages/search_artists.html', results=result_data, search_term=search_term)
   except Exception as e:
     error_logger(e, 'Error searching artist')
     flash('Error searching artist')
     return render_template('pages/search_artists.html', results={}, search_term=search_term)
 
-@app.route('/artists/<string:artist_id>')
+@app.route('/artists/all')
+def artist_options():
+  # Query all artists and return Artist list in JSON object to client requesting '/artists/all' endpoint
+  return select_options_response('artist', db.session.query(Artist.id, Artist.name).order_by(Artist.name))
+
+@app.route('/artists/<guid:artist_id>')
+@cached_view(response_cache, artist_page_namespaces, lambda: app.config['CACHE_DETAIL_TTL'])
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # DONE: replace with real venue data from the venues table, using venue_id
 
-  # Query all artists and return Artist list in JSON object to client requesting '/artists/all' endpoint
-  if artist_id == 'all':
-    error = False
-    try:
-      artists = Artist.query.all()
-    except Exception as e:
-      error_logger(e, 'Error fetching artists for select options')
-      error = True
-    finally:
-      if error:
-        return abort(400)
-      else:
-        body = {}
-        artists_list = []
-        body["artists_list"] = []
-        for artist in artists:
-          artist_obj = {
-            "artist_id": artist.id,
-            "artist_name": artist.name
-          }
-          artists_list.append(artist_obj)
-        body["artists_list"] = artists_list
-        return jsonify(body)
-
   try:
-    future_shows = get_upcoming_shows(db, Show, Venue, Artist, artist_id, 'artist')
-    future_shows_count = get_future_shows_count(db, Show, artist_id, 'artist')
-    past_shows = get_past_shows(db, Show, Venue, Artist, artist_id, 'artist')
-    past_shows_count = get_past_shows_count(db, Show, artist_id, 'artist')
-
-    artist = Artist.query.get(artist_id)
-    data = format_artist_page_data(db, Genre, artist, future_shows, future_shows_count, past_shows, past_shows_count)
+    page_key = versioned_key(response_cache, artist_page_namespaces(artist_id), 'artist_page', artist_id)
+    data = artist_page_cache.get(page_key)
+    if data is None:
+      artist, shows_data = detail_queries.run(
+        lambda: Artist.query.options(selectinload(Artist.genres)).get(artist_id),
+        lambda: get_shows_data(db, Show, Venue, Artist, artist_id, 'artist', g.now))
+      future_shows, future_shows_count, past_shows, past_shows_count = shows_data
+      data = format_artist_page_data(db, Genre, artist, future_shows, future_shows_count, past_shows, past_shows_count)
+      artist_page_cache.set(page_key, data, get_page_cache_ttl(data, app.config['PAGE_CACHE_TTL'], g.now))
+    # the rendered page too must not list a show that started as upcoming
+    limit_response_ttl(get_page_cache_ttl(data, app.config['CACHE_DETAIL_TTL'], g.now))
     return render_template('pages/show_artist.html', artist=data)
   except Exception as e:
     error_logger(e, 'Error fetching artist data')
@@ -388,7 +577,7 @@ def show_artist(artist_id):
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<artist_id>/edit', methods=['GET'])
+@app.route('/artists/<guid:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   form = ArtistForm()
   error = False
@@ -399,7 +588,6 @@ def edit_artist(artist_id):
     error_logger(e, 'Failed to editing artist ' + artist_id )
     error = True
   finally:
-    db.session.close()
     if error:
       return redirect(url_for('show_artist', artist_id=artist_id))
     else:
@@ -407,7 +595,7 @@ def edit_artist(artist_id):
       return render_template('forms/edit_artist.html', form=form, artist=artist)
       
 
-@app.route('/artists/<artist_id>/edit', methods=['POST'])
+@app.route('/artists/<guid:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   # DONE: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
@@ -441,7 +629,6 @@ def edit_artist_submission(artist_id):
     error_logger(e, 'Error updating artist ' + artist_id)
     db.session.rollback()
   finally:
-    db.session.close()
     if error:
       message = 'Error updating Artist'
     else:
@@ -450,7 +637,7 @@ def edit_artist_submission(artist_id):
     return redirect(url_for('show_artist', artist_id=artist_id))
 
 
-@app.route('/venues/<venue_id>/edit', methods=['GET'])
+@app.route('/venues/<guid:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   form = VenueForm()
   # DONE: populate form with values from venue with ID <venue_id>
@@ -462,14 +649,13 @@ def edit_venue(venue_id):
     error_logger(e, 'Failed to editing venue ' + venue_id )
     error = True
   finally:
-    db.session.close()
     if error:
       flash('Could not fetch venue to edit')
       return redirect(url_for('show_venue', venue_id=venue_id))
     else:
       return render_template('forms/edit_venue.html', form=form, venue=venue)
 
-@app.route('/venues/<venue_id>/edit', methods=['POST'])
+@app.route('/venues/<guid:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   # DONE: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
@@ -503,7 +689,6 @@ def edit_venue_submission(venue_id):
     error_logger(e, 'Error updating venue ' + venue_id)
     db.session.rollback()
   finally:
-    db.session.close()
     if error:
       message = 'Error updating Venue'
     else:
@@ -537,7 +722,7 @@ def create_artist_submission():
     else:
       seeking_venue = False
     seeking_description = request.form['seeking_description']
-    a_id = uuid.uuid1()
+    a_id = str(uuid.uuid1())
     new_artist = Artist(id=a_id, 
                         name=name, 
                         city=city, 
@@ -549,8 +734,8 @@ def create_artist_submission():
                         seeking_description=seeking_description)
     db.session.add(new_artist)
     for genre in genres:
-      # get the id of the genre from the genre table in db
-      genre_id = Genre.query.filter_by(name=genre).first().id
+      # get the id of the genre from the genre cache
+      genre_id = get_genre_id(db, Genre, genre)
       # store the venue-genre combination in db
       new_artist_genre = Artist_Genre(artist_id=a_id, genre=genre_id)
       db.session.add(new_artist_genre)
@@ -560,7 +745,6 @@ def create_artist_submission():
     error = True
     db.session.rollback()
   finally:
-    db.session.close()
     # on successful db insert, flash success
     if error:
       message = 'There was an error listing Artist'
@@ -580,12 +764,10 @@ def shows():
   # displays list of shows at /shows
   # DONE: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
-  join_query = db.session.query(Show, Artist, Venue).\
-                          filter(Show.artist_id == Artist.id).\
-                          filter(Show.venue_id == Venue.id).\
-                          all()
-  show_data = format_show_data(join_query)
-  return render_template('pages/shows.html', shows=show_data)
+  # Pages of upcoming shows are sliced from the in-memory feed, see show_feed.py. The feed is per
+  # process, so the page isn't put in the shared response cache, its tiles are cached as fragments.
+  show_data, next_cursor = show_feed.page(g.now, request.args.get('cursor'), app.config['PAGE_SIZE'])
+  return render_template('pages/shows.html', shows=show_data, next_cursor=next_cursor)
 
 @app.route('/shows/create')
 def create_shows():
@@ -598,20 +780,28 @@ def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # DONE: insert form data as a new Show record in the db, instead
   error = False
+  conflict = None
   try:
-    venue_id = request.form['venue_id']
-    artist_id = request.form['artist_id']
-    start_time = request.form['start_time']
-    new_show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
-    db.session.add(new_show)
+    venue_id = parse_guid(request.form['venue_id'])
+    artist_id = parse_guid(request.form['artist_id'])
+    if venue_id is None or artist_id is None:
+      raise ValueError('venue_id and artist_id must be UUIDs')
+    # times without a timezone are taken as UTC
+    start_time = as_utc(dateutil.parser.parse(request.form['start_time']))
+    book_show(db, Show, Venue, Artist, venue_id, artist_id, start_time, show_duration)
+    # the commit also wakes the show feed refresh, see bump_invalidated_namespaces
     db.session.commit()
+  except BookingConflict as e:
+    db.session.rollback()
+    conflict = e
   except Exception as e:
     error_logger(e, 'Error in show creation')
     db.session.rollback()
     error = True
   finally:
-    db.session.close()
-    if error:
+    if conflict is not None:
+      message = 'Show could not be listed, ' + str(conflict)
+    elif error:
       message = 'An error occured while creating show'
     else:
       message = 'Successfully created a new show'
@@ -622,6 +812,157 @@ def create_show_submission():
     # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
     return render_template('pages/home.html')
 
+@app.route('/shows/availability')
+def show_availability():
+  # tells whether a show of venue_id and/or artist_id can start at start_time, for calendar UIs
+  ids = {}
+  for name in ('venue_id', 'artist_id'):
+    value = request.args.get(name)
+    ids[name] = parse_guid(value) if value else None
+    if value and ids[name] is None:
+      return jsonify({ 'success': False, 'message': name + ' must be a UUID' }), 400
+  if ids['venue_id'] is None and ids['artist_id'] is None:
+    return jsonify({ 'success': False, 'message': 'Pass a venue_id, an artist_id or both' }), 400
+  try:
+    # times without a timezone are taken as UTC
+    start_time = as_utc(dateutil.parser.parse(request.args.get('start_time', '')))
+  except (ValueError, OverflowError):
+    return jsonify({ 'success': False, 'message': 'Pass a valid start_time' }), 400
+  conflicts = find_conflicts(db, Show, ids['venue_id'], ids['artist_id'], start_time, show_duration)
+  return jsonify({
+    'success': True,
+    'available': len(conflicts) == 0,
+    'conflicts': [{ 'venue_id': show.venue_id, 'artist_id': show.artist_id, 'start_time': show.start_time.isoformat() }
+                  for show in conflicts]
+  })
+
+# Bulk inserts skip the mapper events: refresh the stats of the imported shows' venues and artists in
+# the batch's transaction, so they commit with the shows, and record their namespaces by hand
+def imported_shows_inserted(shows):
+  venue_ids = set(show['venue_id'] for show in shows)
+  artist_ids = set(show['artist_id'] for show in shows)
+  connection = db.session.connection()
+  refresh_show_stats(connection, Show, Show_Stats, 'venue', venue_ids, request_now())
+  refresh_show_stats(connection, Show, Show_Stats, 'artist', artist_ids, request_now())
+  namespaces = db.session.info.setdefault('invalidated_namespaces', set())
+  namespaces.add('show')
+  namespaces.update('venue:' + venue_id for venue_id in venue_ids)
+  namespaces.update('artist:' + artist_id for artist_id in artist_ids)
+
+@app.route('/shows/import', methods=['POST'])
+def import_shows_submission():
+  # accepts a JSON list of {artist_id, venue_id, start_time} objects
+  # or a CSV upload in the 'file' field with an artist_id,venue_id,start_time header
+  if request.is_json:
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+      return jsonify({ 'success': False, 'message': 'Expected a JSON list of shows' }), 400
+  elif 'file' in request.files:
+    rows = read_csv_upload(request.files['file'])
+  else:
+    return jsonify({ 'success': False, 'message': 'Send a JSON list of shows or a CSV file' }), 400
+  try:
+    report = import_shows(db, Show, Artist, Venue, rows, app.config['IMPORT_BATCH_SIZE'],
+                          imported_shows_inserted, show_duration)
+  except Exception as e:
+    error_logger(e, 'Error in show import')
+    db.session.rollback()
+    return jsonify({ 'success': False, 'message': 'An error occured while importing shows' }), 500
+  report['success'] = True
+  return jsonify(report)
+
+@app.cli.command('import-shows')
+@click.argument('csv_file', type=click.File('r'))
+def import_shows_command(csv_file):
+  """Import shows from a CSV file with an artist_id,venue_id,start_time header."""
+  report = import_shows(db, Show, Artist, Venue, read_csv_rows(csv_file), app.config['IMPORT_BATCH_SIZE'],
+                        imported_shows_inserted, show_duration)
+  click.echo('{received} rows, {imported} imported, {duplicates} duplicates, {errors} errors'.format(
+    received=report['received'], imported=report['imported'], duplicates=report['duplicates'],
+    errors=len(report['errors'])))
+  for error in report['errors']:
+    click.echo('row {row}: {error}'.format(**error), err=True)
+
+@app.cli.command('generate-data')
+@click.option('--venues', default=1000, show_default=True, help='Number of venues.')
+@click.option('--artists', default=5000, show_default=True, help='Number of artists.')
+@click.option('--shows', default=100000, show_default=True, help='Number of shows.')
+@click.option('--seed', default=0, show_default=True, help='Random seed, the same seed gives the same data.')
+@click.option('--anchor', default=None, help='Date shows are spread around, defaults to the start of this year.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per INSERT batch.')
+def generate_data_command(venues, artists, shows, seed, anchor, batch_size):
+  """Generate a deterministic synthetic dataset, rerunning it is a no-op."""
+  counts = generate_dataset(db, Artist, Venue, Show, Genre, Venue_Genre, Artist_Genre,
+                            venues, artists, shows, seed,
+                            dateutil.parser.parse(anchor) if anchor else None, batch_size, show_duration)
+  rebuild_show_stats(db.session.connection(), Show, Show_Stats, utc_now())
+  db.session.commit()
+  # bulk inserts skip the mapper events, so drop every cached page at once
+  response_cache.clear()
+  for namespace in ('venue', 'artist', 'show'):
+    response_cache.bump_version(namespace)
+  click.echo('Inserted ' + ', '.join('{} {} rows'.format(count, table) for table, count in counts.items()))
+
+@app.cli.command('roll-show-stats')
+@click.option('--all', 'rebuild', is_flag=True, help='Recompute the stats of every venue and artist.')
+def roll_show_stats_command(rebuild):
+  """Move started shows from upcoming to past in show_stats, run it periodically, e.x. from cron."""
+  connection = db.session.connection()
+  if rebuild:
+    rebuild_show_stats(connection, Show, Show_Stats, utc_now())
+    rolled = None
+  else:
+    rolled = roll_show_stats(connection, Show, Show_Stats, utc_now())
+  db.session.commit()
+  # the venue listing shows the counts, bulk writes skip the mapper events
+  if rolled != 0:
+    response_cache.bump_version('show')
+  if rolled is None:
+    click.echo('Rebuilt the show stats')
+  else:
+    click.echo('Rolled the show stats of {} venues and artists'.format(rolled))
+
+@app.cli.command('create-show-partitions')
+def create_show_partitions_command():
+  """Create the coming months' show partitions, run it periodically, e.x. from cron."""
+  connection = db.session.connection()
+  if not is_partitioned(connection):
+    click.echo('The show table is not partitioned')
+    return
+  created = create_show_partitions(connection, utc_now(), app.config['SHOW_PARTITION_MONTHS_AHEAD'])
+  db.session.commit()
+  click.echo('Created {} show partitions'.format(len(created)) + ''.join(' ' + name for name in created))
+
+@app.cli.command('archive-shows')
+@click.option('--months', type=int, default=None,
+              help='Archive the months that ended more than this many months ago, defaults to SHOW_ARCHIVE_AFTER_MONTHS.')
+def archive_shows_command(months):
+  """Move the show partitions of old months out of the show table, to SHOW_ARCHIVE_SCHEMA."""
+  connection = db.session.connection()
+  if not is_partitioned(connection):
+    click.echo('The show table is not partitioned')
+    return
+  if months is None:
+    months = app.config['SHOW_ARCHIVE_AFTER_MONTHS']
+  names = expired_partitions(connection, add_months(month_start(utc_now()), -months))
+  if len(names) == 0:
+    click.echo('No show partitions to archive')
+    return
+  venue_ids, artist_ids = partition_entities(connection, names)
+  archive_partitions(connection, names, app.config['SHOW_ARCHIVE_SCHEMA'])
+  # archived shows no longer count, and detaching skips the mapper events
+  refresh_show_stats(connection, Show, Show_Stats, 'venue', venue_ids, utc_now())
+  refresh_show_stats(connection, Show, Show_Stats, 'artist', artist_ids, utc_now())
+  db.session.commit()
+  for namespace in ('venue', 'artist', 'show'):
+    response_cache.bump_version(namespace)
+  click.echo('Archived {} show partitions to {}:'.format(len(names), app.config['SHOW_ARCHIVE_SCHEMA']) +
+             ''.join(' ' + name for name in names))
+
+@app.route('/metrics')
+def metrics():
+  return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -647,6 +988,8 @@ if not app.debug:
 
 # Default port:
 if __name__ == '__main__':
+  with app.app_context():
+    load_genre_cache(db, Genre)
   app.run(host='0.0.0.0', debug=True)
 
 # Or specify port manually:
@@ -0,0 +1,327 @@
+# Benchmarks every route of app.py through the Flask test client at several dataset sizes.
+# Each route is timed with cold caches (and warm caches for pages), and its queries per request
+# and peak Python allocations are recorded. Results are written as sorted JSON, so a baseline
+# committed next to the code shows regressions as diffs, and --baseline compares a run against it.
+#
+# Usage, against the database configured in config.py or a SQLite stand-in:
+#   python benchmark.py --database sqlite:////tmp/fyyur-benchmark.sqlite --sizes 1000,10000
+#   python benchmark.py --baseline benchmark_baseline.json             # compare against it
+#   python benchmark.py --baseline benchmark_baseline.json --record    # (re)record it
+#
+# The dataset of each size is built with data_generator.py. Generating only ever adds rows, so sizes
+# run smallest first and baselines should be recorded on a fresh database, or with --reset which
+# drops and recreates every table before each size. Rows created by the benchmark itself are
+# removed after each route.
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+
+from app import (Artist, Artist_Genre, Genre, Show, Show_Stats, Venue, Venue_Genre, app, artist_page_cache,
+                 db, metrics_registry, response_cache, show_duration, show_feed, venue_page_cache)
+from data_generator import entity_id, generate_dataset
+from database import utc_now
+from helper_functions import load_genre_cache
+from show_stats import rebuild_show_stats, refresh_show_stats
+
+BENCHMARK_PREFIX = 'Benchmark '
+# shows created by the benchmark start after every generated show
+BENCHMARK_SHOW_YEAR = 2100
+# shows per POST /shows/import request
+IMPORT_SHOWS = 100
+
+VENUE_FORM = {
+  'city': 'San Francisco', 'state': 'CA', 'address': '1015 Folsom Street', 'phone': '123-123-1234',
+  'genres': ['Jazz', 'Folk'], 'facebook_link': 'https://www.facebook.com/benchmark',
+  'website': 'https://www.example.com', 'seeking_talent': 'y', 'seeking_description': 'Benchmark'
+}
+ARTIST_FORM = {
+  'city': 'San Francisco', 'state': 'CA', 'phone': '326-123-5000', 'genres': ['Rock n Roll'],
+  'facebook_link': 'https://www.facebook.com/benchmark', 'website': 'https://www.example.com',
+  'seeking_venue': 'y', 'seeking_description': 'Benchmark'
+}
+
+# Venues and artists per show count of a dataset size
+def dataset_counts(shows):
+  return {'venues': max(shows // 50, 10), 'artists': max(shows // 10, 10), 'shows': shows}
+
+# The show feed is reloaded by the next request reading it, see SHOW_FEED_REFRESH_SECONDS below,
+# and so are the entity counts of /metrics
+def clear_caches():
+  response_cache.clear()
+  venue_page_cache.clear()
+  artist_page_cache.clear()
+  show_feed.request_refresh()
+  metrics_registry.entity_counts.expire()
+
+def create_benchmark_venue(number):
+  venue = Venue(id=entity_id('benchmark-venue', number), name=BENCHMARK_PREFIX + 'Venue ' + str(number),
+                city=VENUE_FORM['city'], state=VENUE_FORM['state'])
+  db.session.add(venue)
+  db.session.commit()
+  return venue.id
+
+# Bulk deletes skip the mapper events, the show stats of the entities they touched are refreshed by hand
+def remove_benchmark_rows():
+  benchmark_shows = db.session.query(Show).filter(Show.start_time >= datetime(BENCHMARK_SHOW_YEAR, 1, 1, tzinfo=timezone.utc))
+  touched = {
+    'venue': set(venue_id for (venue_id,) in benchmark_shows.with_entities(Show.venue_id).distinct()),
+    'artist': set(artist_id for (artist_id,) in benchmark_shows.with_entities(Show.artist_id).distinct()),
+  }
+  benchmark_shows.delete(synchronize_session=False)
+  for entity_type, Model, Link, link_id in (('venue', Venue, Venue_Genre, Venue_Genre.venue_id),
+                                            ('artist', Artist, Artist_Genre, Artist_Genre.artist_id)):
+    ids = db.session.query(Model.id).filter(Model.name.like(BENCHMARK_PREFIX + '%'))
+    touched[entity_type].update(entity_id for (entity_id,) in ids)
+    db.session.query(Link).filter(link_id.in_(ids)).delete(synchronize_session=False)
+    db.session.query(Model).filter(Model.name.like(BENCHMARK_PREFIX + '%')).delete(synchronize_session=False)
+  for entity_type, ids in touched.items():
+    refresh_show_stats(db.session.connection(), Show, Show_Stats, entity_type, ids, utc_now())
+  db.session.commit()
+
+# Returns the edit form data of entity, with its current values
+def own_values(entity, form, seeking_field):
+  data = dict(form, name=entity.name, city=entity.city, state=entity.state, phone=entity.phone,
+              facebook_link=entity.facebook_link or '', website=entity.website or '',
+              seeking_description=entity.seeking_description or '')
+  if not getattr(entity, seeking_field):
+    del data[seeking_field]
+  return data
+
+# Returns {name: (method, setup)}, setup is called with the iteration number before each timed
+# request and returns its (path, form data), or its (path, JSON list) for JSON requests. Routes are measured against the most popular
+# venue/artist, which have the most shows, and the least popular ones of the long tail.
+def benchmark_cases(counts):
+  popular_venue = entity_id('venue', 0)
+  popular_artist = entity_id('artist', 0)
+  tail_venue = entity_id('venue', counts['venues'] - 1)
+  tail_artist = entity_id('artist', counts['artists'] - 1)
+
+  def get(path):
+    return lambda number: (path, None)
+
+  def create_venue(number):
+    return '/venues/create', dict(VENUE_FORM, name=BENCHMARK_PREFIX + 'Venue created ' + str(number))
+
+  def create_artist(number):
+    return '/artists/create', dict(ARTIST_FORM, name=BENCHMARK_PREFIX + 'Artist created ' + str(number))
+
+  # a day apart, so every show is booked rather than rejected as a conflict with the previous one
+  def create_show(number):
+    start_time = datetime(BENCHMARK_SHOW_YEAR, 1, 1, 20) + timedelta(days=number)
+    return '/shows/create', {
+      'venue_id': popular_venue, 'artist_id': popular_artist,
+      'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+  # resubmit the venue/artist's own values so the dataset stays unchanged
+  def edit_venue(number):
+    venue = Venue.query.get(tail_venue)
+    return '/venues/{}/edit'.format(tail_venue), own_values(venue, VENUE_FORM, 'seeking_talent')
+
+  def edit_artist(number):
+    artist = Artist.query.get(tail_artist)
+    return '/artists/{}/edit'.format(tail_artist), own_values(artist, ARTIST_FORM, 'seeking_venue')
+
+  def delete_venue(number):
+    return '/venues/' + create_benchmark_venue(number), None
+
+  # IMPORT_SHOWS shows a day apart per request, after the shows of the previous requests
+  def import_shows(number):
+    first_day = datetime(BENCHMARK_SHOW_YEAR, 1, 1, 20) + timedelta(days=(number + 1) * IMPORT_SHOWS)
+    return '/shows/import', [{
+      'venue_id': popular_venue, 'artist_id': popular_artist,
+      'start_time': (first_day + timedelta(days=day)).isoformat()
+    } for day in range(IMPORT_SHOWS)]
+
+  return {
+    'GET /': ('GET', get('/')),
+    'GET /venues': ('GET', get('/venues')),
+    'GET /artists': ('GET', get('/artists')),
+    'GET /shows': ('GET', get('/shows')),
+    'GET /venues/all': ('GET', get('/venues/all')),
+    'GET /artists/all': ('GET', get('/artists/all')),
+    'GET /venues/<popular>': ('GET', get('/venues/' + popular_venue)),
+    'GET /venues/<tail>': ('GET', get('/venues/' + tail_venue)),
+    'GET /artists/<popular>': ('GET', get('/artists/' + popular_artist)),
+    'GET /artists/<tail>': ('GET', get('/artists/' + tail_artist)),
+    'GET /venues/<id>/edit': ('GET', get('/venues/{}/edit'.format(popular_venue))),
+    'GET /artists/<id>/edit': ('GET', get('/artists/{}/edit'.format(popular_artist))),
+    'GET /venues/create': ('GET', get('/venues/create')),
+    'GET /artists/create': ('GET', get('/artists/create')),
+    'GET /shows/create': ('GET', get('/shows/create')),
+    'GET /shows/availability': ('GET', get('/shows/availability?venue_id={}&artist_id={}&start_time={}-01-01T20:00:00'
+                                           .format(popular_venue, popular_artist, BENCHMARK_SHOW_YEAR))),
+    'GET /metrics': ('GET', get('/metrics')),
+    'POST /venues/search': ('POST', lambda number: ('/venues/search', {'search_term': 'blue'})),
+    'POST /artists/search': ('POST', lambda number: ('/artists/search', {'search_term': 'blue'})),
+    'POST /venues/create': ('POST', create_venue),
+    'POST /artists/create': ('POST', create_artist),
+    'POST /shows/create': ('POST', create_show),
+    'POST /shows/import': ('POST', import_shows),
+    'POST /venues/<id>/edit': ('POST', edit_venue),
+    'POST /artists/<id>/edit': ('POST', edit_artist),
+    'DELETE /venues/<id>': ('DELETE', delete_venue),
+  }
+
+class QueryCounter(object):
+  def __init__(self):
+    self.count = 0
+
+  def __call__(self, conn, cursor, statement, parameters, context, executemany):
+    self.count += 1
+
+def measure(client, method, setup, repeat, counter):
+  def request(number):
+    path, data = setup(number)
+    db.session.remove()
+    clear_caches()
+    counter.count = 0
+    start = time.perf_counter()
+    if isinstance(data, list):
+      response = client.open(path, method=method, json=data)
+    else:
+      response = client.open(path, method=method, data=data)
+    # streamed bodies are only generated when read
+    response.get_data()
+    elapsed = (time.perf_counter() - start) * 1000
+    if response.status_code >= 400:
+      raise RuntimeError('{} {} returned {}'.format(method, path, response.status_code))
+    return elapsed, counter.count
+
+  timings = []
+  queries = []
+  for number in range(repeat):
+    elapsed, count = request(number)
+    timings.append(elapsed)
+    queries.append(count)
+
+  tracemalloc.start()
+  request(repeat)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  result = {
+    'median_ms': round(statistics.median(timings), 3),
+    'p95_ms': round(sorted(timings)[int(0.95 * (len(timings) - 1))], 3),
+    'queries': max(queries),
+    'peak_kb': round(peak / 1024, 1),
+  }
+  if method == 'GET':
+    # the first request fills the caches
+    path, data = setup(0)
+    client.get(path).get_data()
+    warm = []
+    for _ in range(repeat):
+      start = time.perf_counter()
+      client.get(path).get_data()
+      warm.append((time.perf_counter() - start) * 1000)
+    result['warm_median_ms'] = round(statistics.median(warm), 3)
+  return result
+
+def run(sizes, repeat, seed, reset):
+  client = app.test_client()
+  counter = QueryCounter()
+  results = {}
+  with app.app_context():
+    db.create_all()
+    event.listen(db.engine, 'before_cursor_execute', counter)
+    try:
+      for size in sizes:
+        counts = dataset_counts(size)
+        if reset:
+          db.session.remove()
+          db.drop_all()
+          db.create_all()
+        generate_dataset(db, Artist, Venue, Show, Genre, Venue_Genre, Artist_Genre,
+                         counts['venues'], counts['artists'], counts['shows'], seed, show_duration=show_duration)
+        rebuild_show_stats(db.session.connection(), Show, Show_Stats, utc_now())
+        db.session.commit()
+        load_genre_cache(db, Genre)
+        remove_benchmark_rows()
+        results[str(size)] = {}
+        for name, (method, setup) in benchmark_cases(counts).items():
+          results[str(size)][name] = measure(client, method, setup, repeat, counter)
+          print('{:>8} {:<26} {}'.format(size, name, results[str(size)][name]))
+          db.session.remove()
+          remove_benchmark_rows()
+    finally:
+      event.remove(db.engine, 'before_cursor_execute', counter)
+  return results
+
+# Returns the regressions of results against baseline, as printable lines.
+# Timings and allocations regress when they grow by more than threshold, queries when they grow at all.
+# Timings within a millisecond of the baseline are noise and never count, and so are p95 timings,
+# the tail of a few requests, which are reported but not compared.
+def compare(baseline, results, threshold):
+  regressions = []
+  for size, cases in results.items():
+    for name, result in cases.items():
+      before = baseline.get('sizes', {}).get(size, {}).get(name)
+      if before is None:
+        continue
+      for metric, value in sorted(result.items()):
+        old = before.get(metric)
+        if old is None or metric == 'p95_ms':
+          continue
+        if metric == 'queries':
+          regressed = value > old
+        else:
+          regressed = old > 0 and value / old > threshold and (metric == 'peak_kb' or value - old > 1)
+        if regressed:
+          regressions.append('{} {} {}: {} -> {}'.format(size, name, metric, old, value))
+  return regressions
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the fyyur routes')
+  parser.add_argument('--database', help='database URL to run against instead of the one in config.py')
+  parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated numbers of shows')
+  parser.add_argument('--repeat', type=int, default=20, help='timed requests per route')
+  parser.add_argument('--seed', type=int, default=0, help='seed of the generated dataset')
+  parser.add_argument('--reset', action='store_true',
+                      help='drop and recreate every table before each size, this deletes all data')
+  parser.add_argument('--output', help='write the results as JSON to this file')
+  parser.add_argument('--baseline', help='compare against this JSON file')
+  parser.add_argument('--record', action='store_true',
+                      help='write the results to the --baseline file instead of comparing, review before committing it')
+  parser.add_argument('--threshold', type=float, default=1.5,
+                      help='timing and allocation ratio over the baseline counted as a regression')
+  args = parser.parse_args()
+  if args.record and not args.baseline:
+    parser.error('--record needs --baseline')
+  if args.baseline and not args.record and not os.path.exists(args.baseline):
+    parser.error('no baseline ' + args.baseline + ', record one with --record')
+
+  if args.database:
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+  app.config['WTF_CSRF_ENABLED'] = False
+  # no background feed reloads, their queries would be counted against the request being measured
+  app.config['SHOW_FEED_REFRESH_SECONDS'] = 0
+  sizes = sorted(int(size) for size in args.sizes.split(','))
+  results = {
+    'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+    'repeat': args.repeat,
+    'sizes': run(sizes, args.repeat, args.seed, args.reset),
+  }
+
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump(results, output, indent=2, sort_keys=True)
+  if args.record:
+    with open(args.baseline, 'w') as output:
+      json.dump(results, output, indent=2, sort_keys=True)
+    print('Recorded baseline ' + args.baseline)
+  elif args.baseline:
+    with open(args.baseline) as baseline_file:
+      regressions = compare(json.load(baseline_file), results['sizes'], args.threshold)
+    for regression in regressions:
+      print('REGRESSION ' + regression)
+    if regressions:
+      sys.exit(1)
+    print('No regressions against ' + args.baseline)
@@ -0,0 +1,93 @@
+from bisect import bisect_right, insort
+from collections import defaultdict
+
+from sqlalchemy import or_
+
+# Booking conflicts.
+# A show occupies its venue and its artist for SHOW_DURATION_MINUTES from its start time, so two
+# shows of the same venue or artist conflict when they start less than that apart. Every show lasts
+# the same, so the shows conflicting with one starting at t are those starting in
+# (t - duration, t + duration), a range scan of the (venue_id, start_time) and (artist_id, start_time)
+# indexes.
+# show is partitioned by start_time and postgres only allows exclusion constraints on a partitioned
+# table that compare its partition key with equality, which can't express overlaps. Bookings lock
+# the rows of their venues and artists FOR UPDATE before checking instead, so concurrent bookings
+# of a venue or artist run one after the other. Locks are taken in id order, venues first, so
+# bookings never deadlock each other.
+
+class BookingConflict(ValueError):
+  def __init__(self, entity_type, start_time):
+    self.entity_type = entity_type
+    self.start_time = start_time
+    super(BookingConflict, self).__init__('the {} already has a show at {}'.format(entity_type, start_time.isoformat()))
+
+def lock_booking_entities(db, Venue, Artist, venue_ids, artist_ids):
+  for Model, ids in ((Venue, venue_ids), (Artist, artist_ids)):
+    ids = sorted(set(ids))
+    if len(ids) > 0:
+      db.session.query(Model.id).filter(Model.id.in_(ids)).order_by(Model.id).with_for_update().all()
+
+# Returns the (venue_id, artist_id, start_time) of the shows conflicting with a show of venue_id and
+# artist_id starting at start_time, ordered by start time. Either id may be None to only check
+# the other one.
+def find_conflicts(db, Show, venue_id, artist_id, start_time, duration):
+  booked = []
+  if venue_id is not None:
+    booked.append(Show.venue_id == venue_id)
+  if artist_id is not None:
+    booked.append(Show.artist_id == artist_id)
+  return db.session.query(Show.venue_id, Show.artist_id, Show.start_time)\
+                   .filter(or_(*booked))\
+                   .filter(Show.start_time > start_time - duration, Show.start_time < start_time + duration)\
+                   .order_by(Show.start_time)\
+                   .all()
+
+# Adds a show to the session unless it conflicts with another, in which case BookingConflict is
+# raised. The caller commits, which releases the locks.
+def book_show(db, Show, Venue, Artist, venue_id, artist_id, start_time, duration):
+  lock_booking_entities(db, Venue, Artist, [venue_id], [artist_id])
+  conflicts = find_conflicts(db, Show, venue_id, artist_id, start_time, duration)
+  if len(conflicts) > 0:
+    conflict = conflicts[0]
+    raise BookingConflict('venue' if conflict.venue_id == venue_id else 'artist', conflict.start_time)
+  show = Show(artist_id=artist_id, venue_id=venue_id, start_time=start_time)
+  db.session.add(show)
+  return show
+
+# The start times of the shows of a set of venues and artists, sorted per venue and per artist, to
+# check many bookings without a query each, e.x. an import batch
+class BookingIndex(object):
+  def __init__(self, duration):
+    self.duration = duration
+    self.venue_times = defaultdict(list)
+    self.artist_times = defaultdict(list)
+    self.shows = set()
+
+  def add(self, venue_id, artist_id, start_time):
+    insort(self.venue_times[venue_id], start_time)
+    insort(self.artist_times[artist_id], start_time)
+    self.shows.add((venue_id, artist_id, start_time))
+
+  def __contains__(self, show):
+    return show in self.shows
+
+  # Returns the BookingConflict of a show of venue_id and artist_id starting at start_time, or None
+  def conflict(self, venue_id, artist_id, start_time):
+    for entity_type, times in (('venue', self.venue_times.get(venue_id)), ('artist', self.artist_times.get(artist_id))):
+      if times:
+        index = bisect_right(times, start_time - self.duration)
+        if index < len(times) and times[index] < start_time + self.duration:
+          return BookingConflict(entity_type, times[index])
+    return None
+
+# Returns the BookingIndex of the shows of the given venues and artists that could conflict with
+# shows starting between first_start_time and last_start_time
+def load_booking_index(db, Show, venue_ids, artist_ids, first_start_time, last_start_time, duration):
+  index = BookingIndex(duration)
+  shows = db.session.query(Show.venue_id, Show.artist_id, Show.start_time)\
+                    .filter(or_(Show.venue_id.in_(venue_ids), Show.artist_id.in_(artist_ids)))\
+                    .filter(Show.start_time > first_start_time - duration,
+                            Show.start_time < last_start_time + duration)
+  for venue_id, artist_id, start_time in shows:
+    index.add(venue_id, artist_id, start_time)
+  return index
@@ -0,0 +1,249 @@
+import functools
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app, g, request, session
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+try:
+  import redis
+except ImportError:
+  redis = None
+
+# Cache backends share one interface:
+#   get(key, default=None), set(key, value, ttl=None), delete(key), clear()
+#   version(namespace) and bump_version(namespace)
+#   bumped_within(namespaces, seconds), True when one of namespaces was bumped in the last seconds
+#   hits and misses, the number of get() calls that found and missed their key in this process
+#   shared, True when every app process sees the same entries and versions
+# Namespace versions are folded into cache keys, so bumping a namespace's version
+# invalidates every key built from it without having to find and delete those keys.
+
+# A thread safe, size bounded, least recently used cache.
+# Entries can carry a time to live in seconds, expired entries are dropped when they are read.
+class LRUCache(object):
+  shared = False
+
+  def __init__(self, max_size=1024, default_ttl=None):
+    self.max_size = max_size
+    self.default_ttl = default_ttl
+    self._entries = OrderedDict()
+    # versions are kept apart from the entries so they are never evicted, and carry a
+    # per-process token because other processes keep their own versions
+    self._versions = {}
+    self._bumped_at = {}
+    self._token = uuid.uuid4().hex[:12]
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return default
+      value, expires_at = entry
+      if expires_at is not None and expires_at <= time.monotonic():
+        del self._entries[key]
+        self.misses += 1
+        return default
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def set(self, key, value, ttl=None):
+    if ttl is None:
+      ttl = self.default_ttl
+    expires_at = None if ttl is None else time.monotonic() + ttl
+    with self._lock:
+      self._entries[key] = (value, expires_at)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+  def delete(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def version(self, namespace):
+    return '{}.{}'.format(self._token, self._versions.get(namespace, 0))
+
+  def bump_version(self, namespace):
+    with self._lock:
+      self._versions[namespace] = self._versions.get(namespace, 0) + 1
+      self._bumped_at[namespace] = time.time()
+
+  def bumped_within(self, namespaces, seconds):
+    since = time.time() - seconds
+    return any(self._bumped_at.get(namespace, 0) > since for namespace in namespaces)
+
+  def __len__(self):
+    return len(self._entries)
+
+# A cache stored in Redis, or anything speaking its protocol, shared by every app process.
+# client is a redis.Redis compatible client, e.x. fakeredis.FakeStrictRedis() in tests.
+# Values are pickled, so only cache data produced by the app itself.
+class RedisCache(object):
+  shared = True
+
+  def __init__(self, client, default_ttl=None, key_prefix='fyyur:'):
+    self.client = client
+    self.default_ttl = default_ttl
+    self.key_prefix = key_prefix
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key, default=None):
+    value = self.client.get(self.key_prefix + key)
+    if value is None:
+      self.misses += 1
+      return default
+    self.hits += 1
+    return pickle.loads(value)
+
+  def set(self, key, value, ttl=None):
+    if ttl is None:
+      ttl = self.default_ttl
+    # redis expiries are whole, positive seconds
+    ttl = None if ttl is None else max(1, int(ttl))
+    self.client.set(self.key_prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=ttl)
+
+  def delete(self, key):
+    self.client.delete(self.key_prefix + key)
+
+  # Drops every entry but keeps the namespace versions, so keys built from old versions never come back
+  def clear(self):
+    version_prefix = (self.key_prefix + 'version:').encode('utf-8')
+    keys = [key for key in self.client.scan_iter(match=self.key_prefix + '*')
+            if not key.startswith(version_prefix)]
+    if keys:
+      self.client.delete(*keys)
+
+  def version(self, namespace):
+    value = self.client.get(self.key_prefix + 'version:' + namespace)
+    return '0' if value is None else value.decode('ascii')
+
+  def bump_version(self, namespace):
+    key = self.key_prefix + 'version:' + namespace
+    pipeline = self.client.pipeline()
+    pipeline.incr(key)
+    pipeline.set(key + ':bumped_at', repr(time.time()))
+    pipeline.execute()
+
+  def bumped_within(self, namespaces, seconds):
+    if len(namespaces) == 0:
+      return False
+    since = time.time() - seconds
+    values = self.client.mget([self.key_prefix + 'version:' + namespace + ':bumped_at' for namespace in namespaces])
+    return any(value is not None and float(value) > since for value in values)
+
+# Builds the cache backend selected by the CACHE_* settings of config.py
+def create_cache(config):
+  backend = config['CACHE_BACKEND']
+  if backend == 'lru':
+    return LRUCache(config['CACHE_MAX_SIZE'])
+  if backend == 'redis':
+    if redis is None:
+      raise RuntimeError('CACHE_BACKEND is redis but the redis package is not installed')
+    return RedisCache(redis.Redis.from_url(config['CACHE_REDIS_URL']), key_prefix=config['CACHE_KEY_PREFIX'])
+  raise ValueError('Unknown CACHE_BACKEND ' + repr(backend))
+
+# Returns a cache key made of parts and the current versions of namespaces
+def versioned_key(cache, namespaces, *parts):
+  versions = ['{}={}'.format(namespace, cache.version(namespace)) for namespace in namespaces]
+  return ':'.join([str(part) for part in parts] + versions)
+
+# Caches the rendered HTML of a GET view.
+# namespaces is called with the view arguments and returns the namespaces the page depends on,
+# ttl returns the time to live in seconds, which the view can shorten with limit_response_ttl.
+# Only plain rendered pages are cached: views returning Response objects or status tuples, and
+# requests that flash messages, are passed through.
+# A page missing right after a write bumped one of its namespaces is rendered from the primary: a
+# lagging replica could still return the rows of before the write, which would then be cached under
+# the new versions until they expire. "Right after" is the READ_YOUR_WRITES_SECONDS window.
+def cached_view(cache, namespaces, ttl):
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(**view_args):
+      if session.get('_flashes'):
+        return view(**view_args)
+      page_namespaces = namespaces(**view_args)
+      key = versioned_key(cache, page_namespaces, 'view', request.full_path)
+      body = cache.get(key)
+      if body is None:
+        window = current_app.config.get('READ_YOUR_WRITES_SECONDS', 0)
+        if g.get('read_from_replica') and window and cache.bumped_within(page_namespaces, window):
+          g.read_from_replica = False
+        body = view(**view_args)
+        seconds = min(ttl(), g.get('response_ttl_limit', ttl()))
+        if isinstance(body, str) and not session.get('_flashes') and seconds > 0:
+          cache.set(key, body, seconds)
+      return body
+    return wrapper
+  return decorator
+
+# Caps the time the response of the current request is cached for by cached_view, e.x. until the
+# next show on the page starts
+def limit_response_ttl(seconds):
+  g.response_ttl_limit = min(seconds, g.get('response_ttl_limit', seconds))
+
+# Passes the chunks of a streamed body through and caches the joined body once it is complete
+def cache_stream(cache, key, chunks, ttl):
+  body = []
+  for chunk in chunks:
+    body.append(chunk)
+    yield chunk
+  cache.set(key, ''.join(body), ttl)
+
+# Caches rendered template fragments, e.x. the tile of a show on a listing:
+#   {% cache ['show', show.artist_id, show.venue_id], ['artist:' ~ show.artist_id] %} ... {% endcache %}
+# The first list identifies the fragment and the second lists the namespaces it depends on.
+# Fragments are stored in environment.fragment_cache, keyed by the versions of their namespaces in
+# environment.fragment_versions, the cache whose namespaces are bumped on writes. Versions are read
+# once per request, however many fragments depend on them. Fragments expire after the default_ttl of
+# fragment_cache. Without a fragment_cache bodies are rendered every time.
+class FragmentCacheExtension(Extension):
+  tags = set(['cache'])
+
+  def __init__(self, environment):
+    super(FragmentCacheExtension, self).__init__(environment)
+    environment.extend(fragment_cache=None, fragment_versions=None)
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    key_parts = parser.parse_expression()
+    parser.stream.expect('comma')
+    namespaces = parser.parse_expression()
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    call = self.call_method('_render_fragment', [key_parts, namespaces])
+    return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+  def _render_fragment(self, key_parts, namespaces, caller):
+    cache = self.environment.fragment_cache
+    if cache is None:
+      return caller()
+    key = fragment_key(self.environment.fragment_versions, key_parts, namespaces)
+    fragment = cache.get(key)
+    if fragment is None:
+      fragment = caller()
+      cache.set(key, str(fragment))
+    # fragments are stored rendered, so they must not be escaped again
+    return Markup(fragment)
+
+def fragment_key(versions_cache, key_parts, namespaces):
+  versions = g.setdefault('fragment_namespace_versions', {})
+  for namespace in namespaces:
+    if namespace not in versions:
+      versions[namespace] = versions_cache.version(namespace)
+  return ':'.join(['fragment'] + [str(part) for part in key_parts] +
+                  ['{}={}'.format(namespace, versions[namespace]) for namespace in namespaces])
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g
+
+# Runs the independent queries of a request concurrently, on a bounded pool of threads.
+# Each call runs in its own app context, so it gets its own session and pooled connection, which is
+# removed when the call returns. Calls must return plain data or fully loaded, e.x. eager loaded,
+# objects since their session is gone by the time the results are used.
+# With max_workers 0 the calls run one after another in the request's own session.
+
+# Request state the calls need: where to read from and the request's now (database.py), and where
+# to count queries (instrumentation.py)
+PROPAGATED_REQUEST_STATE = ('read_from_replica', 'now', 'query_stats')
+
+class QueryExecutor(object):
+  def __init__(self, app, max_workers):
+    self.app = app
+    self.executor = None
+    if max_workers:
+      self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='fyyur-query')
+
+  # Runs calls and returns their results in order, re-raising the first error
+  def run(self, *calls):
+    if self.executor is None:
+      return [call() for call in calls]
+    state = dict((name, g.get(name)) for name in PROPAGATED_REQUEST_STATE if name in g)
+    futures = [self.executor.submit(self.run_in_app_context, call, state) for call in calls]
+    return [future.result() for future in futures]
+
+  def run_in_app_context(self, call, state):
+    with self.app.app_context():
+      for name, value in state.items():
+        setattr(g, name, value)
+      return call()
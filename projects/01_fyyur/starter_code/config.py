@@ -7,8 +7,98 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 DEBUG = True
 
 # Connect to the database
+def env_flag(name, default):
+  return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
 
+# heroku style postgres:// urls are not accepted by SQLAlchemy 1.4
+def database_url(url):
+  if url.startswith('postgres://'):
+    return 'postgresql://' + url[len('postgres://'):]
+  return url
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql:///fyyur'
+SQLALCHEMY_DATABASE_URI = database_url(os.environ.get('DATABASE_URL', 'postgresql:///fyyur'))
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Connection pool of PostgreSQL engines, see database.py. Every process holds up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections, keep that times the number of processes under
+# the server's max_connections. Recycle and timeout are in seconds, 0 disables the statement timeout.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', True)
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+# Set when connecting through PgBouncer in transaction pooling mode, PgBouncer then does the pooling
+DB_PGBOUNCER = env_flag('DB_PGBOUNCER', False)
+
+# Read replicas serving GET requests and the searches, as comma separated URLs, see database.py.
+# A replica that fails to connect is skipped for DB_REPLICA_COOLDOWN seconds. After a request of a
+# client commits a write its requests read from the primary for READ_YOUR_WRITES_SECONDS, 0 disables that.
+# Cached pages missing within that many seconds of a write to their data are rendered from the
+# primary too, see cached_view in cache.py, so set it above the replicas' usual lag.
+DATABASE_REPLICA_URLS = [database_url(url.strip())
+                         for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+DB_REPLICA_COOLDOWN = int(os.environ.get('DB_REPLICA_COOLDOWN', 30))
+READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 0))
+
+# Threads running the venue/artist page queries concurrently, shared by all requests, 0 runs them
+# one after another. Each running query holds its own connection, size the pool for it.
+DETAIL_QUERY_WORKERS = int(os.environ.get('DETAIL_QUERY_WORKERS', 0))
+
+# Number of rows per page on the /venues, /artists and /shows listings
+PAGE_SIZE = 50
+
+# Maximum number of venues/artists returned by a search, best matches first
+SEARCH_RESULTS_LIMIT = 50
+# Searches look at most at this many matches: past it the count reads "1000+" and only the first
+# matches found are ranked, so broad terms cost no more than narrow ones, see search.py
+SEARCH_MATCH_LIMIT = 1000
+
+# Venue/artist page view models are cached in process, up to PAGE_CACHE_SIZE pages per type.
+# A page is kept until it changes, its next show starts or PAGE_CACHE_TTL seconds pass.
+PAGE_CACHE_SIZE = 1024
+PAGE_CACHE_TTL = 300
+
+# Response cache of the read routes: 'lru' keeps it in process, 'redis' shares it between
+# processes through the server at CACHE_REDIS_URL (needs the redis package). TTLs are in seconds.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'lru')
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_KEY_PREFIX = 'fyyur:'
+CACHE_MAX_SIZE = 4096
+CACHE_LISTING_TTL = 60
+CACHE_DETAIL_TTL = 60
+# Venue/artist options of the new show form. The lru backend caches them for CACHE_LISTING_TTL
+# instead and serves them without ETags, see select_options_response in app.py.
+CACHE_SELECT_OPTIONS_TTL = 3600
+
+# Rendered listing tiles and rows are cached in process, up to FRAGMENT_CACHE_SIZE fragments,
+# until their venue or artist changes or CACHE_LISTING_TTL seconds pass. See FragmentCacheExtension
+# in cache.py.
+FRAGMENT_CACHE_SIZE = 20000
+# Number of distinct (value, format) pairs the datetime template filter remembers
+DATETIME_FORMAT_CACHE_SIZE = 4096
+
+# Minutes a show books its venue and artist for. Shows of the same venue or artist starting less than
+# that apart are rejected, see booking.py.
+SHOW_DURATION_MINUTES = int(os.environ.get('SHOW_DURATION_MINUTES', 120))
+
+# Seconds between reloads of the in-memory upcoming shows feed of /shows, see show_feed.py. Writes
+# made through this process reload it right away. 0 runs no background thread, the feed is then
+# reloaded by the request reading it after a write of this process, and never otherwise.
+SHOW_FEED_REFRESH_SECONDS = int(os.environ.get('SHOW_FEED_REFRESH_SECONDS', 30))
+
+# Rows validated and inserted per transaction by the bulk show import
+IMPORT_BATCH_SIZE = 1000
+
+# Monthly partitions of the show table on PostgreSQL, see partitions.py. Partitions are created
+# SHOW_PARTITION_MONTHS_AHEAD months ahead, and archived to SHOW_ARCHIVE_SCHEMA once their month
+# ended more than SHOW_ARCHIVE_AFTER_MONTHS months ago.
+SHOW_PARTITION_MONTHS_AHEAD = 12
+SHOW_ARCHIVE_AFTER_MONTHS = 36
+SHOW_ARCHIVE_SCHEMA = 'archive'
+
+# Statements slower than this many milliseconds are logged with their SQL and parameters
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+
+# Seconds the venue/artist/show counts reported by /metrics are reused before being recounted
+METRICS_COUNTS_TTL = 60
@@ -0,0 +1,143 @@
+import random
+import uuid
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+
+from booking import BookingIndex
+from helper_functions import insert_ignoring_duplicates, seed_genres
+
+# Deterministic synthetic dataset for performance testing.
+# The same arguments always produce the same rows: ids are derived from the row number with uuid5 and
+# every table draws from its own seeded random generator. Rows are written in batches with
+# INSERT ... ON CONFLICT DO NOTHING, so a rerun is a no-op and growing the counts only adds rows.
+# Popularity is Zipf distributed: a handful of venues, artists and cities get most of the shows
+# and the rest form a long tail.
+
+ID_NAMESPACE = uuid.UUID('6f1f2c1e-8a51-4c8e-9b0e-2f4f6d7c9a10')
+
+CITIES = [('New York', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'), ('Nashville', 'TN'), ('Austin', 'TX'),
+          ('San Francisco', 'CA'), ('Seattle', 'WA'), ('New Orleans', 'LA'), ('Atlanta', 'GA'), ('Boston', 'MA'),
+          ('Denver', 'CO'), ('Philadelphia', 'PA'), ('Portland', 'OR'), ('Miami', 'FL'), ('Detroit', 'MI'),
+          ('Minneapolis', 'MN'), ('Las Vegas', 'NV'), ('Houston', 'TX'), ('Kansas City', 'MO'), ('Phoenix', 'AZ')]
+VENUE_WORDS = ['Hall', 'Lounge', 'Club', 'Theatre', 'Bar', 'Room', 'Garden', 'Cellar', 'Stage', 'Hop']
+ARTIST_WORDS = ['Band', 'Trio', 'Quartet', 'Collective', 'Project', 'Ensemble', 'Orchestra', 'Crew']
+NAME_WORDS = ['Blue', 'Golden', 'Wild', 'Silver', 'Electric', 'Velvet', 'Midnight', 'Crimson', 'Neon', 'Lucky',
+              'Rusty', 'Broken', 'Hollow', 'Jazz', 'Sax', 'Piano', 'Fox', 'Owl', 'River', 'Moon']
+SHOW_HOURS = [18, 19, 20, 21, 22]
+SHOW_MINUTES = [0, 30]
+SHOW_SLOTS = [(hour, minute) for hour in SHOW_HOURS for minute in SHOW_MINUTES]
+
+def entity_id(kind, number):
+  return str(uuid.uuid5(ID_NAMESPACE, '{}-{}'.format(kind, number)))
+
+# Cumulative Zipf weights of ranks 1..count, the first rank being the most popular
+def zipf_cum_weights(count, exponent=1.1):
+  return list(accumulate(1.0 / rank ** exponent for rank in range(1, count + 1)))
+
+# Picks an index in O(log n) given cumulative weights
+def weighted_index(rng, cum_weights):
+  return bisect(cum_weights, rng.random() * cum_weights[-1])
+
+def entity_name(rng, number, kind_words):
+  return '{} {} {} {}'.format('The', rng.choice(NAME_WORDS), rng.choice(kind_words), number)
+
+def generate_venues(count, seed):
+  rng = random.Random('{}-venues'.format(seed))
+  city_weights = zipf_cum_weights(len(CITIES))
+  for number in range(count):
+    city, state = CITIES[weighted_index(rng, city_weights)]
+    yield {
+      'id': entity_id('venue', number),
+      'name': entity_name(rng, number, VENUE_WORDS),
+      'city': city,
+      'state': state,
+      'address': '{} Main Street'.format(rng.randint(1, 9999)),
+      'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+      'seeking_talent': rng.random() < 0.3,
+      'seeking_description': None
+    }
+
+def generate_artists(count, seed):
+  rng = random.Random('{}-artists'.format(seed))
+  city_weights = zipf_cum_weights(len(CITIES))
+  for number in range(count):
+    city, state = CITIES[weighted_index(rng, city_weights)]
+    yield {
+      'id': entity_id('artist', number),
+      'name': entity_name(rng, number, ARTIST_WORDS),
+      'city': city,
+      'state': state,
+      'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+      'seeking_venue': rng.random() < 0.4,
+      'seeking_description': None
+    }
+
+# Every venue/artist gets one to four genres
+def generate_genre_links(kind, count, genre_ids, seed):
+  rng = random.Random('{}-{}-genres'.format(seed, kind))
+  for number in range(count):
+    for genre_id in rng.sample(genre_ids, rng.randint(1, 4)):
+      yield {kind + '_id': entity_id(kind, number), 'genre': genre_id}
+
+# Shows are spread over the three years before and the year after anchor, in the evening.
+# With a show_duration, see booking.py, a show conflicting with one generated before it at its venue
+# or artist moves to the next free slot of its day, and is skipped when there is none.
+def generate_shows(count, venues, artists, anchor, seed, show_duration=None):
+  rng = random.Random('{}-shows'.format(seed))
+  venue_weights = zipf_cum_weights(venues)
+  artist_weights = zipf_cum_weights(artists)
+  bookings = None if show_duration is None else BookingIndex(show_duration)
+  for _ in range(count):
+    day = anchor + timedelta(days=rng.randint(-3 * 365, 365))
+    venue_id = entity_id('venue', weighted_index(rng, venue_weights))
+    artist_id = entity_id('artist', weighted_index(rng, artist_weights))
+    first = SHOW_SLOTS.index((rng.choice(SHOW_HOURS), rng.choice(SHOW_MINUTES)))
+    for hour, minute in SHOW_SLOTS[first:] + SHOW_SLOTS[:first]:
+      start_time = day.replace(hour=hour, minute=minute)
+      if bookings is None or bookings.conflict(venue_id, artist_id, start_time) is None:
+        break
+    else:
+      continue
+    if bookings is not None:
+      bookings.add(venue_id, artist_id, start_time)
+    yield {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time}
+
+# Bind parameters per statement, within the limits of both PostgreSQL (65535) and SQLite (32766)
+MAX_STATEMENT_PARAMETERS = 32766
+
+# Writes rows in transactions of batch_size rows and returns the number of rows inserted.
+# Batches are sent as multi-row INSERT statements, so the rowcount of each is the number of rows
+# it inserted, without the duplicates skipped on a rerun.
+def write_batches(db, table, rows, batch_size):
+  statement = insert_ignoring_duplicates(db, table)
+  rows_per_statement = max(1, MAX_STATEMENT_PARAMETERS // len(table.columns))
+  written = 0
+  rows = iter(rows)
+  while True:
+    batch = list(islice(rows, batch_size))
+    if len(batch) == 0:
+      return written
+    for start in range(0, len(batch), rows_per_statement):
+      written += db.session.execute(statement.values(batch[start:start + rows_per_statement])).rowcount
+    db.session.commit()
+
+# Generates the dataset and returns the number of rows inserted per table, 0 for a rerun.
+# anchor is the datetime shows are spread around, it defaults to the start of the current year in UTC.
+# show_duration is the timedelta a show books its venue and artist for, None lets generated shows overlap.
+def generate_dataset(db, Artist, Venue, Show, Genre, Venue_Genre, Artist_Genre,
+                     venues, artists, shows, seed=0, anchor=None, batch_size=5000, show_duration=None):
+  if anchor is None:
+    anchor = datetime(datetime.now(timezone.utc).year, 1, 1, tzinfo=timezone.utc)
+  genre_ids = sorted(seed_genres(db, Genre).keys())
+  return {
+    'venue': write_batches(db, Venue.__table__, generate_venues(venues, seed), batch_size),
+    'artist': write_batches(db, Artist.__table__, generate_artists(artists, seed), batch_size),
+    'venue_genre': write_batches(db, Venue_Genre.__table__,
+                                 generate_genre_links('venue', venues, genre_ids, seed), batch_size),
+    'artist_genre': write_batches(db, Artist_Genre.__table__,
+                                  generate_genre_links('artist', artists, genre_ids, seed), batch_size),
+    'show': write_batches(db, Show.__table__,
+                          generate_shows(shows, venues, artists, anchor, seed, show_duration) if venues and artists else [],
+                          batch_size)
+  }
@@ -0,0 +1,287 @@
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_app_context, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import CHAR, DateTime, event, exc, orm
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.types import TypeDecorator
+from werkzeug.routing import UUIDConverter
+
+# Engine setup from the DB_* settings of config.py.
+# PostgreSQL engines get an explicit connection pool: its size, overflow, recycle time, checkout
+# timeout and pre-ping, plus a statement timeout. Other databases, e.x. the SQLite stand-in of
+# benchmark.py, keep Flask-SQLAlchemy's defaults. SQLALCHEMY_ENGINE_OPTIONS still wins over these.
+#
+# With DB_PGBOUNCER the app sits behind PgBouncer in transaction pooling mode: PgBouncer owns the
+# pool, so the engine opens and closes a connection per checkout (NullPool), and since PgBouncer
+# rejects startup options the statement timeout is set with SET LOCAL at the start of every transaction.
+#
+# Read replicas, from DATABASE_REPLICA_URLS, serve the reads of GET and HEAD requests, and of the
+# views of other methods marked read_only, e.x. the search forms. Each request session picks one
+# replica, in turn, skipping replicas that failed to connect in the last DB_REPLICA_COOLDOWN
+# seconds, and falls back to the primary when none is left. Everything else goes to the primary:
+# other requests, writes and anything read after them, CLI commands, and requests within
+# READ_YOUR_WRITES_SECONDS of the same client's last committed write, so users see what they just
+# submitted even when the replicas lag behind, and cached pages filled within as long of a write
+# to their data, see cached_view in cache.py.
+
+READ_YOUR_WRITES_COOKIE = 'fyyur_primary_until'
+SAFE_METHODS = ('GET', 'HEAD')
+
+# Venue and artist ids, and the columns referencing them: the native 16 byte uuid type on
+# PostgreSQL, 36 character strings elsewhere. Python always sees the canonical lowercase string,
+# and binding anything that isn't a UUID raises, so ids from users are checked before querying,
+# see GUIDConverter.
+class GUID(TypeDecorator):
+  impl = CHAR(36)
+  cache_ok = True
+
+  def load_dialect_impl(self, dialect):
+    if dialect.name == 'postgresql':
+      return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+    return dialect.type_descriptor(CHAR(36))
+
+  def process_bind_param(self, value, dialect):
+    if value is None:
+      return None
+    return str(uuid.UUID(str(value)))
+
+  def process_result_value(self, value, dialect):
+    if value is None:
+      return None
+    return str(value)
+
+# <guid:...> URL parts: match UUIDs only, so other ids are a 404, and pass them on as lowercase strings
+class GUIDConverter(UUIDConverter):
+  def to_python(self, value):
+    return value.lower()
+
+  def to_url(self, value):
+    return str(value)
+
+# Returns the canonical form of a UUID string, or None when value is not a UUID
+def parse_guid(value):
+  try:
+    return str(uuid.UUID(str(value).strip()))
+  except ValueError:
+    return None
+
+# Points in time, e.x. show start times: timestamptz on PostgreSQL, naive UTC timestamps elsewhere.
+# Python always sees timezone aware UTC datetimes. Naive datetimes bound to it are taken as UTC.
+class UTCDateTime(TypeDecorator):
+  impl = DateTime
+  cache_ok = True
+
+  def load_dialect_impl(self, dialect):
+    if dialect.name == 'postgresql':
+      return dialect.type_descriptor(postgresql.TIMESTAMP(timezone=True))
+    return dialect.type_descriptor(DateTime())
+
+  def process_bind_param(self, value, dialect):
+    if value is None:
+      return None
+    value = as_utc(value)
+    return value if dialect.name == 'postgresql' else value.replace(tzinfo=None)
+
+  def process_result_value(self, value, dialect):
+    if value is None:
+      return None
+    return as_utc(value)
+
+def utc_now():
+  return datetime.now(timezone.utc)
+
+# Returns value in UTC, naive datetimes are taken as UTC already
+def as_utc(value):
+  if value.tzinfo is None:
+    return value.replace(tzinfo=timezone.utc)
+  return value.astimezone(timezone.utc)
+
+# The current request's "now", see init_request_time, or the current time outside of requests.
+# Every past/upcoming split of a request uses it, so they agree with each other.
+def request_now():
+  if has_app_context() and 'now' in g:
+    return g.now
+  return utc_now()
+
+def init_request_time(app):
+  @app.before_request
+  def set_request_time():
+    g.now = utc_now()
+
+def postgres_engine_options(config):
+  if config['DB_PGBOUNCER']:
+    return {'poolclass': NullPool}
+  options = {
+    'pool_size': config['DB_POOL_SIZE'],
+    'max_overflow': config['DB_MAX_OVERFLOW'],
+    'pool_recycle': config['DB_POOL_RECYCLE'],
+    'pool_timeout': config['DB_POOL_TIMEOUT'],
+    'pool_pre_ping': config['DB_POOL_PRE_PING'],
+  }
+  if config['DB_STATEMENT_TIMEOUT_MS']:
+    options['connect_args'] = {'options': '-c statement_timeout={:d}'.format(config['DB_STATEMENT_TIMEOUT_MS'])}
+  return options
+
+class ReplicaSet(object):
+  def __init__(self, urls, engines, cooldown):
+    self.urls = urls
+    self.engines = engines
+    self.cooldown = cooldown
+    self._turns = itertools.count()
+    self._unhealthy_until = {}
+
+  # Returns the next healthy replica engine, or None when there is none
+  def choose(self):
+    now = time.monotonic()
+    for _ in range(len(self.engines)):
+      engine = self.engines[next(self._turns) % len(self.engines)]
+      if self._unhealthy_until.get(engine, 0) <= now:
+        return engine
+    return None
+
+  def mark_unhealthy(self, engine):
+    self._unhealthy_until[engine] = time.monotonic() + self.cooldown
+
+# True when the current request may read from a replica, see concurrent_queries.py for app
+# contexts serving a request
+def reads_from_replica():
+  return has_app_context() and g.get('read_from_replica', False)
+
+class RoutingSession(SignallingSession):
+  def __init__(self, db, **options):
+    self.db = db
+    super(RoutingSession, self).__init__(db, **options)
+
+  def get_bind(self, mapper=None, clause=None, **kwargs):
+    if self._flushing or isinstance(clause, UpdateBase):
+      # reads after a write must see it, send the rest of the session to the primary
+      self.info['wrote'] = True
+    elif reads_from_replica() and not self.info.get('wrote'):
+      if 'replica' not in self.info:
+        self.info['replica'] = self.connect_replica()
+      if self.info['replica'] is not None:
+        return self.info['replica']
+    return super(RoutingSession, self).get_bind(mapper, clause)
+
+  # Connects the session to the next replica that accepts a connection and returns its engine,
+  # or None when none does. Replicas failing to connect are taken out of rotation.
+  def connect_replica(self):
+    replicas = self.db.get_replicas()
+    for _ in range(len(replicas.engines)):
+      replica = replicas.choose()
+      if replica is None:
+        break
+      try:
+        self.connection(bind_arguments={'bind': replica})
+        return replica
+      except exc.DBAPIError:
+        replicas.mark_unhealthy(replica)
+    return None
+
+class FyyurSQLAlchemy(SQLAlchemy):
+  def __init__(self, *args, **kwargs):
+    self._replicas = None
+    self._replicas_lock = threading.Lock()
+    super(FyyurSQLAlchemy, self).__init__(*args, **kwargs)
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+  def apply_driver_hacks(self, app, sa_url, options):
+    sa_url, options = super(FyyurSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+    if sa_url.drivername.startswith('postgresql'):
+      for name, value in postgres_engine_options(app.config).items():
+        if name == 'connect_args':
+          options['connect_args'] = dict(value, **options.get('connect_args', {}))
+        else:
+          options.setdefault(name, value)
+    return sa_url, options
+
+  def create_engine(self, sa_url, engine_opts):
+    engine = super(FyyurSQLAlchemy, self).create_engine(sa_url, engine_opts)
+    config = self.get_app().config
+    if sa_url.drivername.startswith('postgresql') and config['DB_PGBOUNCER'] and config['DB_STATEMENT_TIMEOUT_MS']:
+      statement = 'SET LOCAL statement_timeout = {:d}'.format(config['DB_STATEMENT_TIMEOUT_MS'])
+
+      # runs on the DBAPI cursor, inside the transaction the driver opens implicitly
+      @event.listens_for(engine, 'begin')
+      def set_statement_timeout(connection):
+        cursor = connection.connection.cursor()
+        try:
+          cursor.execute(statement)
+        finally:
+          cursor.close()
+    return engine
+
+  # Returns the ReplicaSet of DATABASE_REPLICA_URLS, replica engines get the primary's options
+  def get_replicas(self):
+    app = self.get_app()
+    urls = tuple(app.config['DATABASE_REPLICA_URLS'])
+    with self._replicas_lock:
+      if self._replicas is None or self._replicas.urls != urls:
+        engines = []
+        for url in urls:
+          sa_url, options = self.apply_driver_hacks(app, make_url(url), dict(app.config['SQLALCHEMY_ENGINE_OPTIONS']))
+          engines.append(self.create_engine(sa_url, options))
+        self._replicas = replicas = ReplicaSet(urls, engines, app.config['DB_REPLICA_COOLDOWN'])
+        for engine in engines:
+          self.watch_replica_health(replicas, engine)
+      return self._replicas
+
+  # Replicas dropping connections mid-request are taken out of rotation too
+  def watch_replica_health(self, replicas, engine):
+    @event.listens_for(engine, 'handle_error')
+    def replica_disconnected(context):
+      if context.is_disconnect:
+        replicas.mark_unhealthy(engine)
+
+  # {name: engine} of the primary and the replicas
+  def named_engines(self):
+    engines = {'primary': self.engine}
+    for index, engine in enumerate(self.get_replicas().engines):
+      engines['replica-{}'.format(index)] = engine
+    return engines
+
+# Requests committing a write open their client's read your writes window
+@event.listens_for(RoutingSession, 'after_commit')
+def record_committed_write(session):
+  if session.info.get('wrote') and has_request_context():
+    g.committed_write = True
+
+# Lets a view of another method than GET and HEAD read from the replicas, for forms that only read.
+# Goes below @app.route:
+#   @app.route('/venues/search', methods=['POST'])
+#   @read_only
+def read_only(view):
+  view.read_only = True
+  return view
+
+def recently_wrote():
+  try:
+    return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+  except ValueError:
+    return False
+
+# Decides where each request reads from, and opens the read your writes window after writes
+def init_replica_routing(app):
+  @app.before_request
+  def route_request_reads():
+    view = app.view_functions.get(request.endpoint)
+    reads_only = request.method in SAFE_METHODS or getattr(view, 'read_only', False)
+    g.read_from_replica = reads_only and not recently_wrote()
+
+  @app.after_request
+  def open_read_your_writes_window(response):
+    window = app.config['READ_YOUR_WRITES_SECONDS']
+    if window and g.get('committed_write'):
+      response.set_cookie(READ_YOUR_WRITES_COOKIE, '{:.3f}'.format(time.time() + window),
+                          max_age=window, httponly=True, samesite='Lax')
+    return response
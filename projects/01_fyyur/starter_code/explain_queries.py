@@ -0,0 +1,177 @@
+# Prints the postgres query plans and latencies of the queries behind the venue/artist
+# pages, the venue listing and the name searches, so index changes can be compared.
+#
+# Usage, against the database configured in config.py:
+#   python explain_queries.py --seed-shows 1000000     # optional, builds a synthetic dataset
+#   python explain_queries.py --output before.json
+#   flask db upgrade
+#   python explain_queries.py --output after.json
+# Cases reading tables or columns the database doesn't have yet are skipped, e.x. the venue listing
+# before the show_stats migration and the ranked searches before the search vectors one, so an
+# older revision reports the cases it can run and before/after compare those.
+import argparse
+import json
+import statistics
+import time
+
+from sqlalchemy import event, inspect, text
+
+from app import Artist, Show, Show_Stats, Venue, app, db
+from database import utc_now
+from helper_functions import (get_shows_data, get_venues_with_upcoming_counts,
+                              search_results_format)
+from search import escape_like, search_entities
+from show_stats import rebuild_show_stats
+
+# Synthetic rows are generated inside postgres with generate_series. Venue and artist
+# picks are skewed with power(random(), 3) so a few of them get most of the shows.
+SEED_STATEMENTS = [
+  """INSERT INTO venue (id, name, city, state, seeking_talent)
+     SELECT md5('venue' || i)::uuid, 'Venue ' || i, 'City ' || (i % 500), 'CA', false
+     FROM generate_series(1, :venues) AS i
+     ON CONFLICT DO NOTHING""",
+  """INSERT INTO artist (id, name, city, state, seeking_venue)
+     SELECT md5('artist' || i)::uuid, 'Artist ' || i, 'City ' || (i % 500), 'NY', false
+     FROM generate_series(1, :artists) AS i
+     ON CONFLICT DO NOTHING""",
+  """INSERT INTO show (artist_id, venue_id, start_time)
+     SELECT md5('artist' || (floor(:artists * power(random(), 3))::int + 1))::uuid,
+            md5('venue' || (floor(:venues * power(random(), 3))::int + 1))::uuid,
+            date_trunc('minute', now() - interval '5 years' + random() * interval '6 years')
+     FROM generate_series(1, :shows)
+     ON CONFLICT DO NOTHING""",
+  "ANALYZE",
+]
+
+
+# Returns what the queries need of the schema that the database has: 'show_stats' and 'search_vector'
+def schema_features():
+  inspector = inspect(db.engine)
+  features = set()
+  if inspector.has_table(Show_Stats.__tablename__):
+    features.add('show_stats')
+  if all('search_vector' in [column['name'] for column in inspector.get_columns(Model.__tablename__)]
+         for Model in (Venue, Artist)):
+    features.add('search_vector')
+  return features
+
+
+def seed(shows, features):
+  params = {"shows": shows, "venues": max(shows // 1000, 10), "artists": max(shows // 200, 10)}
+  with db.engine.begin() as connection:
+    for statement in SEED_STATEMENTS[:-1]:
+      connection.execute(text(statement), params)
+    if 'show_stats' in features:
+      rebuild_show_stats(connection, Show, Show_Stats, utc_now())
+  # ANALYZE can't run inside the transaction block above
+  with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+    connection.execute(text(SEED_STATEMENTS[-1]))
+
+
+# Runs fn and returns the (statement, parameters) pairs it sent to the database
+def capture_statements(fn):
+  statements = []
+  def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements.append((statement, parameters))
+  event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+  try:
+    fn()
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+  return statements
+
+
+def explain(statement, parameters):
+  connection = db.engine.raw_connection()
+  try:
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + statement, parameters)
+    plan = '\n'.join(row[0] for row in cursor.fetchall())
+    connection.rollback()
+    return plan
+  finally:
+    connection.close()
+
+
+def busiest(show_id):
+  return db.session.query(show_id).group_by(show_id)\
+                   .order_by(db.func.count(show_id).desc()).limit(1).scalar()
+
+
+def name_matches(Model, search_term):
+  return db.session.query(Model.id, Model.name)\
+                   .filter(Model.name.ilike('%' + escape_like(search_term) + '%', escape='\\'))\
+                   .order_by(Model.name, Model.id)\
+                   .limit(app.config['SEARCH_RESULTS_LIMIT'])\
+                   .all()
+
+
+# Returns {name: (schema features needed, case)}
+def benchmark_cases():
+  venue_id = busiest(Show.venue_id)
+  artist_id = busiest(Show.artist_id)
+  now = utc_now()
+  return {
+    "venue_page_shows": ((), lambda: get_shows_data(db, Show, Venue, Artist, venue_id, 'venue', now)),
+    "artist_page_shows": ((), lambda: get_shows_data(db, Show, Venue, Artist, artist_id, 'artist', now)),
+    "venue_listing": (('show_stats',), lambda: get_venues_with_upcoming_counts(
+      db, Show, Venue, Show_Stats, now, None, app.config['PAGE_SIZE'])),
+    # the name match of the searches, served by the trigram indexes, runs on every revision
+    "venue_name_match": ((), lambda: name_matches(Venue, 'ue 12')),
+    "artist_name_match": ((), lambda: name_matches(Artist, 'ist 12')),
+    "venue_search": (('show_stats', 'search_vector'), lambda: search_results_format(
+      db, Show, Show_Stats, search_entities(db, Venue, 'ue 12', app.config['SEARCH_RESULTS_LIMIT'],
+                                            app.config['SEARCH_MATCH_LIMIT']), 'venue', now)),
+    "artist_search": (('show_stats', 'search_vector'), lambda: search_results_format(
+      db, Show, Show_Stats, search_entities(db, Artist, 'ist 12', app.config['SEARCH_RESULTS_LIMIT'],
+                                            app.config['SEARCH_MATCH_LIMIT']), 'artist', now)),
+  }
+
+
+def run(repeat, features):
+  results = {}
+  for name, (needs, case) in benchmark_cases().items():
+    missing = [feature for feature in needs if feature not in features]
+    if missing:
+      print('== {} skipped, the database has no {} yet'.format(name, ', '.join(missing)))
+      continue
+    timings = []
+    for _ in range(repeat):
+      start = time.perf_counter()
+      case()
+      timings.append((time.perf_counter() - start) * 1000)
+      db.session.rollback()
+    plans = [explain(statement, parameters) for statement, parameters in capture_statements(case)]
+    db.session.rollback()
+    results[name] = {
+      "median_ms": round(statistics.median(timings), 3),
+      "max_ms": round(max(timings), 3),
+      "queries": len(plans),
+      "plans": plans,
+    }
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Explain and time the main fyyur queries')
+  parser.add_argument('--seed-shows', type=int, default=0,
+                      help='insert this many synthetic shows before measuring')
+  parser.add_argument('--repeat', type=int, default=20)
+  parser.add_argument('--output', help='write the results as JSON to this file')
+  args = parser.parse_args()
+
+  with app.app_context():
+    features = schema_features()
+    if args.seed_shows:
+      seed(args.seed_shows, features)
+    results = run(args.repeat, features)
+
+  for name, result in results.items():
+    print('== {} median {}ms max {}ms, {} queries'.format(
+      name, result["median_ms"], result["max_ms"], result["queries"]))
+    for plan in result["plans"]:
+      print(plan)
+      print()
+  if args.output:
+    with open(args.output, 'w') as output:
+      json.dump(results, output, indent=2)
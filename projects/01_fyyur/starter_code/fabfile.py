@@ -4,15 +4,27 @@ from fabric.contrib.console import confirm
 # prepare for deployment
 
 
+BENCHMARK = (
+    "python benchmark.py --database sqlite:////tmp/fyyur-benchmark.sqlite"
+    " --reset --sizes 1000,10000 --baseline benchmark_baseline.json"
+)
+
+
 def test():
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        # unit tests of the caches, booking checks and pagination, then
+        # benchmarks every route on a SQLite stand-in, failing on regressions
+        # against the committed benchmark_baseline.json, or when it is missing
+        result = local("python -m pytest -q tests && " + BENCHMARK, capture=True)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def record_baseline():
+    # rewrites benchmark_baseline.json, review the diff before committing it
+    local(BENCHMARK + " --record")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -38,18 +50,11 @@ def heroku():
     local("git push heroku master")
 
 
-def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
-
-
 def deploy():
     pull()
     test()
     commit()
     heroku()
-    heroku_test()
 
 # rollback
 
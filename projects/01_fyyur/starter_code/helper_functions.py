@@ -1,9 +1,31 @@
+import base64
+import json
 import traceback
 import logging
+import threading
 import uuid
-from sqlalchemy import func
+import dateutil.parser
+from collections import namedtuple
+from sqlalchemy import DateTime, and_, func, or_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime
 
+from database import GUID, parse_guid
+from show_stats import compute_show_stats, get_show_stats, is_stale
+
+# Compact read-only records rendered by the venue and artist pages, they are cached between requests
+VenuePage = namedtuple('VenuePage', ['id', 'name', 'genres', 'city', 'state', 'phone', 'address', 'website',
+                                     'facebook_link', 'seeking_talent', 'seeking_description', 'image_link',
+                                     'past_shows', 'upcoming_shows', 'past_shows_count', 'upcoming_shows_count'])
+ArtistPage = namedtuple('ArtistPage', ['id', 'name', 'genres', 'city', 'state', 'phone', 'facebook_link',
+                                       'seeking_venue', 'seeking_description', 'image_link',
+                                       'past_shows', 'upcoming_shows', 'past_shows_count', 'upcoming_shows_count'])
+# A show as listed on a venue page and on an artist page
+VenueShow = namedtuple('VenueShow', ['artist_id', 'artist_name', 'artist_image_link', 'start_time'])
+ArtistShow = namedtuple('ArtistShow', ['venue_id', 'venue_name', 'venue_image_link', 'start_time'])
+# A venue as listed on the venues page
+VenueListing = namedtuple('VenueListing', ['id', 'name', 'city', 'state', 'num_upcoming_shows'])
+
 def error_logger(e, message):
   logging.error(traceback.format_exc)
   print(e.__doc__)
@@ -12,31 +34,30 @@ def error_logger(e, message):
   print(message)
 
 # Given an sql result data and type, return the required structured data to render on search results
-def search_results_format(db, Show, data, type):
+# now is the request's current time, shows after it are upcoming
+# count is the number of matches, when data only holds the best of them, and a count over
+# count_limit is shown as count_limit+
+def search_results_format(db, Show, Show_Stats, data, type, now, count=None, count_limit=None):
   data_list_length = len(data)
 
   if data_list_length == 0:
     return { "count": 0, "data": [] }
-  
+
+  # read the upcoming shows count of every result from its show_stats row
+  shows_stats = get_show_stats(db.session, Show, Show_Stats, type, [item.id for item in data], now)
   result_data = []
-  if type == 'venue':
-    for venue in data:
-      venue_obj = {}
-      venue_obj["id"] = venue.id
-      venue_obj["name"] = venue.name
-      venue_obj["num_upcoming_shows"] = get_future_shows_count(db, Show, venue.id, 'venue')
-      result_data.append(venue_obj)
-
-  elif type == 'artist':
-    for artist in data:
-      artist_obj = {}
-      artist_obj["id"] = artist.id
-      artist_obj["name"] = artist.name
-      artist_obj["num_upcoming_shows"] = get_future_shows_count(db, Show, artist.id, 'artist')
-      result_data.append(artist_obj)
+  for item in data:
+    item_obj = {}
+    item_obj["id"] = item.id
+    item_obj["name"] = item.name
+    item_obj["num_upcoming_shows"] = shows_stats[item.id].upcoming_count if item.id in shows_stats else 0
+    result_data.append(item_obj)
 
   result_object = {}
-  result_object["count"] = data_list_length
+  result_object["count"] = data_list_length if count is None else count
+  result_object["more"] = count_limit is not None and result_object["count"] > count_limit
+  if result_object["more"]:
+    result_object["count"] = count_limit
   result_object["data"] = result_data
   return result_object
 
@@ -64,34 +85,79 @@ def generate_artist_genres(Artist_Genre, genre_dict, artist_id, genre_list):
     artist_genres.append(artist_genre)
   return artist_genres
 
+# Given an (id, name) query, stream a select options JSON document in the form
+# {"<type>s_list": [{"<type>_id": ..., "<type>_name": ...}, ...]} chunk by chunk
+def stream_select_options(query, type, chunk_size=500):
+  yield '{"' + type + 's_list": ['
+  separator = ''
+  for entity_id, name in query.yield_per(chunk_size):
+    yield separator + json.dumps({type + "_id": entity_id, type + "_name": name})
+    separator = ','
+  yield ']}'
+
+# Process wide genre cache holding a (genre_id -> name, name -> genre_id) pair of dictionaries.
+# Genres almost never change, so the table is read once and kept until a genre is written.
+genre_cache = None
+genre_cache_lock = threading.Lock()
+
+def load_genre_cache(db, Genre):
+  global genre_cache
+  with genre_cache_lock:
+    if genre_cache is None:
+      names_by_id = {}
+      ids_by_name = {}
+      for genre in Genre.query.all():
+        names_by_id[genre.id] = genre.name
+        ids_by_name[genre.name] = genre.id
+      genre_cache = (names_by_id, ids_by_name)
+    return genre_cache
+
+def invalidate_genre_cache():
+  global genre_cache
+  with genre_cache_lock:
+    genre_cache = None
+
+# Return a dictionary in the form {genre_id: genre_name}
 def get_genre_dict(db, Genre):
-  genre_dict = {}
-  stored_genres = Genre.query.all()
-  for genre in stored_genres:
-    genre_dict[genre.id] = genre.name
-  return genre_dict
-  
+  cache = genre_cache or load_genre_cache(db, Genre)
+  return cache[0]
+
+# Given a genre name return its id, raises KeyError for unknown genres
+def get_genre_id(db, Genre, genre_name):
+  cache = genre_cache or load_genre_cache(db, Genre)
+  return cache[1][genre_name]
+
+GENRES = ['Jazz', 'Classical', 'Reggae', 'Alternative', 'Country', 'Electronic', 'Folk', 'Funk', 'Soul', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Musical Theatre', 'Pop', 'Punk', 'Blues', 'R&B', 'Rock n Roll', 'Other']
+
+# Adds the genres missing from the genre table in one commit and returns the genre dictionary
+def seed_genres(db, Genre):
+  stored_genres = set(name for (name,) in db.session.query(Genre.name))
+  new_genres = [Genre(id=index, name=genre) for index, genre in enumerate(GENRES) if genre not in stored_genres]
+  if len(new_genres) > 0:
+    try:
+      db.session.add_all(new_genres)
+      db.session.commit()
+    except Exception as e:
+      error_logger(e, 'Error in genre seeding')
+      db.session.rollback()
+  return get_genre_dict(db, Genre)
+
+# Returns an INSERT for table that skips rows conflicting with existing ones where the database supports it
+def insert_ignoring_duplicates(db, table):
+  dialect = db.engine.dialect.name
+  if dialect == 'postgresql':
+    return postgresql.insert(table).on_conflict_do_nothing()
+  elif dialect == 'sqlite':
+    return sqlite.insert(table).on_conflict_do_nothing()
+  return table.insert()
+
 # Seeds app database with data identical to mock data initially started with
 def seed_db(db, Artist, Venue, Show, Genre, Venue_Genre, Artist_Genre):
-  genre_dict = {}
   #  Genres
   #  ----------------------------------------------------------------
-  # Seed Genres table
-  genres = ['Jazz', 'Classical', 'Reggae', 'Alternative', 'Country', 'Electronic', 'Folk', 'Funk', 'Soul', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Musical Theatre', 'Pop', 'Punk', 'Blues', 'R&B', 'Rock n Roll', 'Other']
-  for index, genre in enumerate(genres):
-    query_count = Genre.query.filter_by(name=genre).count()
-    if query_count == False:
-      try:
-        new_genre = Genre(id=index, name=genre)
-        db.session.add(new_genre)
-        db.session.commit()
-      except Exception as e:
-        error_logger(e, 'Error in genre seeding')
-        db.session.rollback()
-      finally:
-        genre_dict[index] = genre
-        db.session.close()
-    
+  # Seed Genres table, the dictionary holds the stored ids even when the genres were seeded before
+  genre_dict = seed_genres(db, Genre)
+
   #  Venues
   #  ----------------------------------------------------------------  
   # Seed Venues table if empty
@@ -177,10 +243,10 @@ def seed_db(db, Artist, Venue, Show, Genre, Venue_Genre, Artist_Genre):
   #  Shows
   #  ----------------------------------------------------------------
   if Show.query.count() == 0:
-    show1 = Show(venue_id=v_id1, artist_id=a_id1, start_time="2019-05-21T21:30:00.000Z")
-    show2 = Show(venue_id=v_id3, artist_id=a_id2, start_time="2019-06-15T23:00:00.000Z")
-    show3 = Show(venue_id=v_id3, artist_id=a_id3, start_time="2035-04-01T20:00:00.000Z")
-    show4 = Show(venue_id=v_id3, artist_id=a_id3, start_time="2035-04-15T20:00:00.000Z")
+    show1 = Show(venue_id=v_id1, artist_id=a_id1, start_time=dateutil.parser.parse("2019-05-21T21:30:00.000Z"))
+    show2 = Show(venue_id=v_id3, artist_id=a_id2, start_time=dateutil.parser.parse("2019-06-15T23:00:00.000Z"))
+    show3 = Show(venue_id=v_id3, artist_id=a_id3, start_time=dateutil.parser.parse("2035-04-01T20:00:00.000Z"))
+    show4 = Show(venue_id=v_id3, artist_id=a_id3, start_time=dateutil.parser.parse("2035-04-15T20:00:00.000Z"))
     try:
       db.session.add_all([show1, show2, show3, show4])
       db.session.commit()
@@ -190,229 +256,233 @@ def seed_db(db, Artist, Venue, Show, Genre, Venue_Genre, Artist_Genre):
     finally:
       db.session.close()
 
+# A keyset cursor holds the sort key values of the last row of a page,
+# serialized as url safe base64 json so it can be passed around as a query parameter
+def encode_cursor(values):
+  values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+  return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+# Returns the list of values stored in a cursor, or None when the cursor is missing or malformed
+def decode_cursor(cursor):
+  if not cursor:
+    return None
+  try:
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+  except (ValueError, TypeError):
+    return None
+  if not isinstance(values, list):
+    return None
+  return values
+
+# True for DateTime columns, including those of a decorated DateTime type, e.x. UTCDateTime
+def is_datetime_column(column):
+  return isinstance(getattr(column.type, 'impl', column.type), DateTime)
+
+# Returns the values of a cursor converted for its sort columns, or None when they don't fit them:
+# ids must be UUIDs, times parseable strings and other values of the column's python type, as
+# encode_cursor writes them, and only nullable columns may be null. Cursors are user input, a bad
+# one must not reach the database.
+def cursor_sort_values(sort_columns, values):
+  if values is None or len(values) != len(sort_columns):
+    return None
+  converted = []
+  for column, value in zip(sort_columns, values):
+    if value is None and column.nullable:
+      converted.append(None)
+      continue
+    if isinstance(column.type, GUID):
+      value = parse_guid(value) if isinstance(value, str) else None
+    elif is_datetime_column(column):
+      try:
+        value = dateutil.parser.parse(value) if isinstance(value, str) else None
+      except (ValueError, OverflowError):
+        value = None
+    elif not isinstance(value, column.type.python_type):
+      value = None
+    if value is None:
+      return None
+    converted.append(value)
+  return converted
+
+# Filter of the rows sorting after values, in the order of sort_columns with NULLs last.
+# A row value comparison is NULL as soon as either side holds a NULL, so the columns are compared
+# one after the other, NULLs matching NULLs.
+def sorts_after(sort_columns, values):
+  after = []
+  equal = []
+  for column, value in zip(sort_columns, values):
+    # nothing sorts after a NULL of its column
+    if value is not None:
+      greater = column > value
+      if column.nullable:
+        greater = or_(greater, column.is_(None))
+      after.append(and_(*(equal + [greater])))
+    equal.append(column.is_(None) if value is None else column == value)
+  return or_(*after)
+
+# Given a query, its sort columns and a cursor, return a page of at most page_size rows that sort
+# after the cursor, along with the cursor of the next page (None on the last page).
+# The sort columns must end with a unique column so the ordering is total.
+# row_key returns the sort values of a row, it defaults to reading the sort columns off the row.
+# A missing or malformed cursor starts at the first page. NULLs sort last, they are kept in cursors.
+def paginate_keyset(query, sort_columns, cursor, page_size, row_key=None):
+  values = cursor_sort_values(sort_columns, decode_cursor(cursor))
+  nullable = any(column.nullable for column in sort_columns)
+  if values is not None and nullable:
+    query = query.filter(sorts_after(sort_columns, values))
+  elif values is not None:
+    query = query.filter(tuple_(*sort_columns) > tuple_(*values))
+  order = [column.asc().nulls_last() if column.nullable else column for column in sort_columns]
+  # fetch one extra row to know if there is a next page
+  rows = query.order_by(*order).limit(page_size + 1).all()
+  next_cursor = None
+  if len(rows) > page_size:
+    rows = rows[:page_size]
+    if row_key is None:
+      last_values = [getattr(rows[-1], column.key) for column in sort_columns]
+    else:
+      last_values = row_key(rows[-1])
+    next_cursor = encode_cursor(last_values)
+  return rows, next_cursor
+
+# Returns a page of venue listing rows in the form (id, name, city, state, num_upcoming_shows)
+# ordered by area so each area's venues stay together, along with the next page cursor.
+# The upcoming shows counts are read from the show_stats rows joined to the venues of the page,
+# the few stale ones are recomputed from the shows.
+def get_venues_with_upcoming_counts(db, Show, Venue, Show_Stats, now, cursor=None, page_size=50):
+  current_date = now
+  venues = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state,
+                            func.coalesce(Show_Stats.upcoming_count, 0).label('num_upcoming_shows'),
+                            Show_Stats.next_show_time)\
+                     .outerjoin(Show_Stats, (Show_Stats.entity_type == 'venue') & (Show_Stats.entity_id == Venue.id))
+  venues, next_cursor = paginate_keyset(venues, [Venue.state, Venue.city, Venue.name, Venue.id], cursor, page_size)
+  stale = [venue.id for venue in venues if is_stale(venue, current_date)]
+  fresh = compute_show_stats(db.session, Show, 'venue', stale, current_date) if len(stale) > 0 else {}
+  listing = []
+  for venue in venues:
+    num_upcoming_shows = venue.num_upcoming_shows
+    if venue.id in stale:
+      num_upcoming_shows = fresh[venue.id].upcoming_count if venue.id in fresh else 0
+    listing.append(VenueListing(venue.id, venue.name, venue.city, venue.state, num_upcoming_shows))
+  return listing, next_cursor
+
+# Returns the number of venues, artists, shows and upcoming shows in the form {entity: count}
+def get_entity_counts(db, Show, Venue, Artist, now):
+  current_date = now
+  return {
+    'venue': db.session.query(func.count(Venue.id)).scalar(),
+    'artist': db.session.query(func.count(Artist.id)).scalar(),
+    'show': db.session.query(func.count(Show.start_time)).scalar(),
+    'upcoming_show': db.session.query(func.count(Show.start_time)).filter(Show.start_time > current_date).scalar()
+  }
+
 # The function recievies a list of venues data fetched from DB
 # and returns a list of sorted data organized by city, state
 def get_venue_data(venues_list):
-  data = []
-  tuple_set = set()
+  # areas are keyed by (city, state) so each venue is grouped in constant time,
+  # dicts keep insertion order so the areas stay in the order of the query
+  areas = {}
   for x in venues_list:
-    if (x.city, x.state) not in tuple_set:
-      tuple_set.add((x.city, x.state))
-      data.append({'city': x.city, 'state': x.state, 'venues': [{'id': x.id, 'name':x.name, 'num_upcoming_shows': 0}]})
-    else:
-      for y in data:
-        if y['city'] == x.city and y['state'] == x.state:
-          y['venues'].append({'id': x.id, 'name': x.name, 'upcoming_shows': 0})
-  return data
+    area_key = (x.city, x.state)
+    if area_key not in areas:
+      areas[area_key] = {'city': x.city, 'state': x.state, 'venues': []}
+    areas[area_key]['venues'].append({'id': x.id, 'name': x.name, 'num_upcoming_shows': x.num_upcoming_shows})
+  return list(areas.values())
 
-# Given a Venue object and genre dictionary, return the required data structure to render on venue page
+# Given a Venue object and its shows, return the required data structure to render on venue page
 def format_venue_page_data(db, Genre, venue, future_shows=[], future_shows_count=0, past_shows=[], past_shows_count=0):
   genre_dict = get_genre_dict(db, Genre)
   genre_list = []
   for venue_genre in venue.genres:
     genre_name = genre_dict[venue_genre.genre]
     genre_list.append(genre_name)
-  venue_data = {
-    "id": venue.id,
-    "name": venue.name,
-    "genres": genre_list,
-    "city": venue.city,
-    "state": venue.state,
-    "phone": venue.phone,
-    "address": venue.address,
-    "website": venue.website,
-    "facebook_link": venue.facebook_link,
-    "seeking_talent": venue.seeking_talent,
-    "seeking_description": venue.seeking_description,
-    "image_link": venue.image_link,
-    "past_shows": past_shows,
-    "upcoming_shows": future_shows,
-    "past_shows_count": past_shows_count,
-    "upcoming_shows_count": future_shows_count
-  }
-  return venue_data
+  return VenuePage(id=venue.id,
+                   name=venue.name,
+                   genres=tuple(genre_list),
+                   city=venue.city,
+                   state=venue.state,
+                   phone=venue.phone,
+                   address=venue.address,
+                   website=venue.website,
+                   facebook_link=venue.facebook_link,
+                   seeking_talent=venue.seeking_talent,
+                   seeking_description=venue.seeking_description,
+                   image_link=venue.image_link,
+                   past_shows=tuple(past_shows),
+                   upcoming_shows=tuple(future_shows),
+                   past_shows_count=past_shows_count,
+                   upcoming_shows_count=future_shows_count)
 
 # Given a list of artist query result, return the required data structure to render on /artists page
 def format_artist_data(artists):
   data = []
   for artist_tuple in artists:
     artist_object = {
-      "id": artist_tuple[1],
-      "name": artist_tuple[2]
+      "id": artist_tuple.id,
+      "name": artist_tuple.name
     }
     data.append(artist_object)
   return data
 
-# Given an artist and genre dictionary, return the required data structure to render on artist page
+# Given an Artist object and its shows, return the required data structure to render on artist page
 def format_artist_page_data(db, Genre, artist, future_shows=[], future_shows_count=0, past_shows=[], past_shows_count=0):
-  data = {}
   genre_dict = get_genre_dict(db, Genre)
   genre_list = []
   for genre in artist.genres:
     genre_name = genre_dict[genre.genre]
     genre_list.append(genre_name)
-  data["id"] = artist.id
-  data["name"] = artist.name
-  data["genres"] = genre_list
-  data["city"] = artist.city
-  data["state"] = artist.state
-  data["phone"] = artist.phone
-  data["facebook_link"] = artist.facebook_link
-  data["seeking_venue"] = artist.seeking_venue
-  data["seeking_description"] = artist.seeking_description
-  data["image_link"] = artist.image_link
-  data["past_shows"] = past_shows
-  data["upcoming_shows"] = future_shows
-  data["past_shows_count"] = past_shows_count
-  data["upcoming_shows_count"] = future_shows_count
-  return data
-
-# Formats joined query data and returns a list of show data
-def format_show_data(joined_show_artist_venue_data):
-  data = []
-  for show , artist, venue in joined_show_artist_venue_data:
-    show_data = {}
-    show_data["venue_id"] = show.venue_id
-    show_data["venue_name"] = venue.name
-    show_data["artist_id"] = artist.id
-    show_data["artist_name"] = artist.name
-    show_data["artist_image_link"] = artist.image_link
-    show_data["start_time"] = show.start_time.isoformat()
-    data.append(show_data)
-  return data
-
-def get_future_shows_count(db, Show, id, id_type):
-  if id_type == 'artist':
-    show_id = Show.artist_id
-  elif id_type == 'venue':
-    show_id = Show.venue_id
-  else:
-    show_id = Show.artist_id
-  current_date = datetime.today().isoformat()
-  # query retuns a tuple in the form (artist_id/venue_id, future_show_count) 
-  # e.x. (u'fd407ea1-1253-11eb-b418-18a905365095', 3L)
-  filtered_query = db.session.query(show_id, func.count(Show.start_time))\
-                              .select_from(Show).filter(Show.start_time > current_date)\
-                              .filter(show_id == id)\
-                              .group_by(show_id)\
-                              .first()
-  if filtered_query is None: 
-    count = 0 
-  else:
-    count = int(filtered_query[1])
-  return count 
-
-# Given a venue_id returns a tuple with venue name and venue image link
-def get_venue_name_image(db, Venue, venue_id):
-  venue = Venue.query.get(venue_id)
-  return (venue.name, venue.image_link)
-
-# Given an artist_id returns a tuple with artist name and artist image link
-def get_artist_name_image(db, Artist, artist_id):
-  artist = Artist.query.get(artist_id)
-  return (artist.name, artist.image_link)
-
-# Given an artist_id/venue_id return a list of upcoming shows venue data
-def get_upcoming_shows(db, Show, Venue, Artist, id, id_type):
-  data = []
-  current_date = datetime.today().isoformat()
-  if id_type == 'artist':
-    show_id = Show.artist_id
-  elif id_type == 'venue':
-    show_id = Show.venue_id
-  else:
-    show_id = Show.artist_id
-  # get venue name & image_link
-  upcoming_shows = Show.query.filter(Show.start_time > current_date)\
-                              .filter(show_id == id)\
-                              .all()
-  for show in upcoming_shows:
-    start_time = show.start_time
-    if id_type == 'artist':
-      venue_id = show.venue_id
-      venue_name, venue_image_link = get_venue_name_image(db, Venue, venue_id)
-      
-      venue_obj = {}
-      venue_obj["venue_id"] = venue_id
-      venue_obj["venue_name"] = venue_name
-      venue_obj["venue_image_link"] = venue_image_link
-      venue_obj["start_time"] = start_time
-      data.append(venue_obj)
-
-    elif id_type == 'venue':
-      artist_id = show.artist_id
-      artist_name, artist_image_link = get_artist_name_image(db, Artist, artist_id)
-      
-      artist_obj = {}
-      artist_obj["artist_id"] = artist_id
-      artist_obj["artist_name"] = artist_name
-      artist_obj["artist_image_link"] = artist_image_link
-      artist_obj["start_time"] = start_time
-      data.append(artist_obj)
+  return ArtistPage(id=artist.id,
+                    name=artist.name,
+                    genres=tuple(genre_list),
+                    city=artist.city,
+                    state=artist.state,
+                    phone=artist.phone,
+                    facebook_link=artist.facebook_link,
+                    seeking_venue=artist.seeking_venue,
+                    seeking_description=artist.seeking_description,
+                    image_link=artist.image_link,
+                    past_shows=tuple(past_shows),
+                    upcoming_shows=tuple(future_shows),
+                    past_shows_count=past_shows_count,
+                    upcoming_shows_count=future_shows_count)
 
-  return data
-
-# Given an artist_id return a list of past shows venue data
-def get_past_shows(db, Show, Venue, Artist, id, id_type):
-  data = []
-  current_date = datetime.today().isoformat()
-  if id_type == 'artist':
-    show_id = Show.artist_id
-  elif id_type == 'venue':
-    show_id = Show.venue_id
-  else:
-    show_id = Show.artist_id
-  # get venue name & image_link
-  past_shows = Show.query.filter(Show.start_time < current_date)\
-                              .filter(show_id == id)\
-                              .all()
-  for show in past_shows:
-    start_time = show.start_time
-    if id_type == 'artist':
-      venue_id = show.venue_id
-      venue_name, venue_image_link = get_venue_name_image(db, Venue, venue_id)
-      
-      venue_obj = {}
-      venue_obj["venue_id"] = venue_id
-      venue_obj["venue_name"] = venue_name
-      venue_obj["venue_image_link"] = venue_image_link
-      venue_obj["start_time"] = start_time
-      
-      data.append(venue_obj)
-    elif id_type == 'venue':
-      artist_id = show.artist_id
-      artist_name, artist_image_link = get_artist_name_image(db, Artist, artist_id)
-      
-      artist_obj = {}
-      artist_obj["artist_id"] = artist_id
-      artist_obj["artist_name"] = artist_name
-      artist_obj["artist_image_link"] = artist_image_link
-      artist_obj["start_time"] = start_time
-      
-      data.append(artist_obj)
-    
-  return data
+# A page is cached until its first upcoming show starts, at which point that show
+# moves to the past shows. Returns the number of seconds to cache page_data for, capped at max_ttl.
+def get_page_cache_ttl(page_data, max_ttl, now):
+  if len(page_data.upcoming_shows) == 0:
+    return max_ttl
+  seconds_to_next_show = (page_data.upcoming_shows[0].start_time - now).total_seconds()
+  return max(0, min(max_ttl, seconds_to_next_show))
 
-# Given an artist or venue id, get its past shows count
-def get_past_shows_count(db, Show, id, id_type):
-  current_date = datetime.today().isoformat()
-  if id_type == 'artist':
-    show_id = Show.artist_id
-  elif id_type == 'venue':
+# Given an artist_id/venue_id, load all of its shows together with the name and image
+# of the other side of the show in a single joined query, then split them into
+# upcoming and past shows in memory.
+# Shows starting after now, the request's current time, are upcoming.
+# Returns a tuple in the form (upcoming_shows, upcoming_shows_count, past_shows, past_shows_count)
+def get_shows_data(db, Show, Venue, Artist, id, id_type, now):
+  current_date = now
+  if id_type == 'venue':
     show_id = Show.venue_id
+    joined_model = Artist
+    joined_id = Show.artist_id
+    show_record = VenueShow
   else:
     show_id = Show.artist_id
-
-  # query retuns a tuple in the form (artist_id, past_show_count) 
-  # e.x. (u'fd407ea1-1253-11eb-b418-18a905365095', 3L)
-  filtered_query = db.session.query(show_id, func.count(Show.start_time))\
-                              .select_from(Show)\
-                              .filter(Show.start_time < current_date)\
-                              .filter(show_id == id)\
-                              .group_by(show_id)\
-                              .first()
-  if filtered_query is None: 
-    count = 0 
-  else:
-    count = int(filtered_query[1])
-  return count 
\ No newline at end of file
+    joined_model = Venue
+    joined_id = Show.venue_id
+    show_record = ArtistShow
+  # query returns tuples in the form (joined_id, joined_name, joined_image_link, start_time)
+  shows = db.session.query(joined_model.id, joined_model.name, joined_model.image_link, Show.start_time)\
+                    .join(joined_model, joined_model.id == joined_id)\
+                    .filter(show_id == id)\
+                    .order_by(Show.start_time)\
+                    .all()
+  upcoming_shows = []
+  past_shows = []
+  for show in shows:
+    show_obj = show_record(*show)
+    if show_obj.start_time > current_date:
+      upcoming_shows.append(show_obj)
+    else:
+      past_shows.append(show_obj)
+  return (upcoming_shows, len(upcoming_shows), past_shows, len(past_shows))
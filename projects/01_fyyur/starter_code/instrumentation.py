@@ -0,0 +1,86 @@
+import json
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Per-request SQL instrumentation.
+# Cursor events time every statement sent by any engine. Statements run while handling a request
+# are added to that request's QueryStats (g.query_stats), which are reported in a Server-Timing
+# header and a JSON log line per request. Statements slower than SLOW_QUERY_THRESHOLD_MS are
+# logged with their SQL and parameters.
+
+# Longest parameters repr written to a slow query log line
+MAX_LOGGED_PARAMETERS = 2000
+
+class QueryStats(object):
+  def __init__(self):
+    self.count = 0
+    self.total_ms = 0.0
+    self.slowest_ms = 0.0
+    self.slowest_statement = None
+    # a request's queries can run on several threads, see concurrent_queries.py
+    self._lock = threading.Lock()
+
+  def add(self, statement, elapsed_ms):
+    with self._lock:
+      self.count += 1
+      self.total_ms += elapsed_ms
+      if elapsed_ms > self.slowest_ms:
+        self.slowest_ms = elapsed_ms
+        self.slowest_statement = statement
+
+def log_event(logger, level, event_name, **fields):
+  fields['event'] = event_name
+  logger.log(level, json.dumps(fields, default=str, sort_keys=True))
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault('query_start_times', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+  elapsed_ms = (time.perf_counter() - conn.info['query_start_times'].pop()) * 1000
+  if not has_app_context():
+    return
+  stats = g.get('query_stats')
+  if stats is not None:
+    stats.add(statement, elapsed_ms)
+  if elapsed_ms >= current_app.config['SLOW_QUERY_THRESHOLD_MS']:
+    # queries run for a request on another thread have no request context
+    method, path = (request.method, request.path) if has_request_context() else (None, None)
+    log_event(current_app.logger, logging.WARNING, 'slow_query', method=method, path=path,
+              duration_ms=round(elapsed_ms, 3), statement=statement,
+              parameters=repr(parameters)[:MAX_LOGGED_PARAMETERS], executemany=executemany)
+
+# Server-Timing value of a request's database time so far
+def server_timing(stats):
+  return 'db;dur={:.3f};desc="{} queries"'.format(stats.total_ms, stats.count)
+
+def init_instrumentation(app):
+  @app.before_request
+  def start_request_instrumentation():
+    g.query_stats = QueryStats()
+    g.request_start_time = time.perf_counter()
+
+  @app.after_request
+  def report_request_instrumentation(response):
+    stats = g.get('query_stats')
+    if stats is None:
+      return response
+    start_time = g.request_start_time
+    method, path, status = request.method, request.path, response.status_code
+    # streamed bodies keep querying after this point, so the header only covers the queries
+    # run so far and the log line is written once the response is closed
+    response.headers.add('Server-Timing', server_timing(stats))
+
+    def log_request():
+      log_event(app.logger, logging.INFO, 'request', method=method, path=path, status=status,
+                duration_ms=round((time.perf_counter() - start_time) * 1000, 3),
+                queries=stats.count, db_ms=round(stats.total_ms, 3),
+                slowest_ms=round(stats.slowest_ms, 3), slowest_statement=stats.slowest_statement)
+    response.call_on_close(log_request)
+    return response
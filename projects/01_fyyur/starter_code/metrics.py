@@ -0,0 +1,229 @@
+import threading
+import time
+
+from flask import g, request
+
+# Prometheus metrics, rendered in the text exposition format by /metrics.
+# Request counters and histograms are updated as requests are served. Values kept elsewhere,
+# such as pool sizes, cache lookups and row counts, are collected when /metrics is scraped.
+# All values are per process, Prometheus sums them across processes.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Request latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Connection pool checkout wait buckets in seconds
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+def escape_label_value(value):
+  return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_sample(name, label_names, label_values, value):
+  labels = ''
+  if label_names:
+    labels = '{' + ','.join('{}="{}"'.format(label_name, escape_label_value(label_value))
+                            for label_name, label_value in zip(label_names, label_values)) + '}'
+  return '{}{} {}'.format(name, labels, repr(float(value)))
+
+# collect, when given, returns the metric's {label values: value} when it's rendered,
+# for values kept elsewhere such as pool sizes and cache hit counts
+class Metric(object):
+  type = None
+
+  def __init__(self, name, help, label_names=(), collect=None):
+    self.name = name
+    self.help = help
+    self.label_names = tuple(label_names)
+    self.collect = collect
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def render(self):
+    lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.type)]
+    lines.extend(self.samples())
+    return lines
+
+  def samples(self):
+    if self.collect is not None:
+      values = self.collect()
+    else:
+      with self._lock:
+        values = dict(self._values)
+    return [format_sample(self.name, self.label_names, labels, value) for labels, value in sorted(values.items())]
+
+class Counter(Metric):
+  type = 'counter'
+
+  def inc(self, label_values=(), amount=1):
+    with self._lock:
+      self._values[label_values] = self._values.get(label_values, 0) + amount
+
+class Gauge(Metric):
+  type = 'gauge'
+
+class Histogram(Metric):
+  type = 'histogram'
+
+  def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+    super(Histogram, self).__init__(name, help, label_names)
+    self.buckets = tuple(buckets)
+
+  def observe(self, value, label_values=()):
+    with self._lock:
+      counts = self._values.get(label_values)
+      if counts is None:
+        # one count per bucket, then the +Inf count and the sum
+        counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+      for index, bound in enumerate(self.buckets):
+        if value <= bound:
+          counts[index] += 1
+      counts[-2] += 1
+      counts[-1] += value
+
+  def samples(self):
+    with self._lock:
+      values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+    lines = []
+    bucket_labels = self.label_names + ('le',)
+    for labels, counts in values:
+      for bound, count in zip(self.buckets, counts):
+        lines.append(format_sample(self.name + '_bucket', bucket_labels, labels + (repr(bound),), count))
+      lines.append(format_sample(self.name + '_bucket', bucket_labels, labels + ('+Inf',), counts[-2]))
+      lines.append(format_sample(self.name + '_sum', self.label_names, labels, counts[-1]))
+      lines.append(format_sample(self.name + '_count', self.label_names, labels, counts[-2]))
+    return lines
+
+class Registry(object):
+  def __init__(self):
+    self.metrics = []
+
+  def register(self, metric):
+    self.metrics.append(metric)
+    return metric
+
+  def render(self):
+    lines = []
+    for metric in self.metrics:
+      lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# Wraps fn so it's called at most once every ttl seconds, returning the last result in between.
+# wrapper.expire() makes the next call run fn again.
+def cached_for(ttl, fn):
+  state = {'expires_at': 0, 'value': None}
+  lock = threading.Lock()
+  def wrapper():
+    with lock:
+      if time.monotonic() >= state['expires_at']:
+        state['value'] = fn()
+        state['expires_at'] = time.monotonic() + ttl
+      return state['value']
+  def expire():
+    with lock:
+      state['expires_at'] = 0
+  wrapper.expire = expire
+  return wrapper
+
+# Times every connection checkout of pool. The engine calls pool.connect() for each connection
+# it needs, so the wait for a free connection is the time spent in that call.
+def instrument_pool(pool, histogram, label_values):
+  if getattr(pool, 'checkout_wait_instrumented', False):
+    return
+  connect = pool.connect
+  def timed_connect():
+    start = time.perf_counter()
+    try:
+      return connect()
+    finally:
+      histogram.observe(time.perf_counter() - start, label_values)
+  pool.connect = timed_connect
+  pool.checkout_wait_instrumented = True
+
+# Pool size gauges of pools that keep connections, e.x. QueuePool
+def collect_pool_stats(engines):
+  stats = {}
+  for name, engine in engines().items():
+    pool = engine.pool
+    if hasattr(pool, 'checkedout'):
+      stats[(name, 'size')] = pool.size()
+      stats[(name, 'checked_out')] = pool.checkedout()
+      stats[(name, 'checked_in')] = pool.checkedin()
+      stats[(name, 'overflow')] = max(pool.overflow(), 0)
+  return stats
+
+def collect_cache_hit_ratios(caches):
+  ratios = {}
+  for name, cache in caches.items():
+    lookups = cache.hits + cache.misses
+    ratios[(name,)] = cache.hits / lookups if lookups else 0
+  return ratios
+
+def collect_cache_lookups(caches):
+  lookups = {}
+  for name, cache in caches.items():
+    lookups[(name, 'hit')] = cache.hits
+    lookups[(name, 'miss')] = cache.misses
+  return lookups
+
+# Registers the app's metrics and the hooks updating them, and returns the registry.
+#   engines        returns {name: engine} of the database engines whose pools are measured
+#   caches         {name: cache} of the cache.py caches whose hit ratios are reported
+#   entity_counts  returns {entity: row count}, it's called at most once every counts_ttl seconds
+def init_metrics(app, engines, caches, entity_counts, counts_ttl=60):
+  registry = Registry()
+  request_latency = registry.register(Histogram(
+    'fyyur_http_request_duration_seconds', 'Time spent serving requests, streamed bodies included.',
+    ('method', 'route')))
+  requests_total = registry.register(Counter(
+    'fyyur_http_requests_total', 'Requests served by status code.', ('method', 'route', 'status')))
+  queries_total = registry.register(Counter(
+    'fyyur_db_queries_total', 'SQL statements sent while serving requests.', ('method', 'route')))
+  query_seconds = registry.register(Counter(
+    'fyyur_db_query_seconds_total', 'Time spent in SQL statements while serving requests.',
+    ('method', 'route')))
+  pool_wait = registry.register(Histogram(
+    'fyyur_db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.',
+    ('engine',), POOL_WAIT_BUCKETS))
+  registry.register(Gauge(
+    'fyyur_db_pool_connections', 'Connections of the pool by state, size is the configured pool size.',
+    ('engine', 'state'), lambda: collect_pool_stats(engines)))
+  registry.register(Counter(
+    'fyyur_cache_lookups_total', 'Cache lookups by result.', ('cache', 'result'),
+    lambda: collect_cache_lookups(caches)))
+  registry.register(Gauge(
+    'fyyur_cache_hit_ratio', 'Share of cache lookups that were hits since the process started.',
+    ('cache',), lambda: collect_cache_hit_ratios(caches)))
+  # kept on the registry so the counts can be expired, e.x. by benchmark.py between requests
+  counts = registry.entity_counts = cached_for(counts_ttl, entity_counts)
+  registry.register(Gauge(
+    'fyyur_entities', 'Rows per entity, refreshed every {} seconds.'.format(counts_ttl),
+    ('entity',), lambda: dict(((entity,), count) for entity, count in counts().items())))
+
+  @app.before_request
+  def start_request_metrics():
+    g.metrics_start_time = time.perf_counter()
+    for name, engine in engines().items():
+      instrument_pool(engine.pool, pool_wait, (name,))
+
+  @app.after_request
+  def record_request_metrics(response):
+    start_time = g.get('metrics_start_time')
+    if start_time is None:
+      return response
+    # routes are labelled by their rule, not their path, to keep one series per route
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    method = request.method
+    status = str(response.status_code)
+    stats = g.get('query_stats')
+
+    def record():
+      labels = (method, route)
+      request_latency.observe(time.perf_counter() - start_time, labels)
+      requests_total.inc((method, route, status))
+      if stats is not None:
+        queries_total.inc(labels, stats.count)
+        query_seconds.inc(labels, stats.total_ms / 1000)
+    # recorded once the response is closed, so streamed bodies are counted in full
+    response.call_on_close(record)
+    return response
+
+  return registry
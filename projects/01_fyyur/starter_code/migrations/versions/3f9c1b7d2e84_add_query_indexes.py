@@ -0,0 +1,53 @@
+"""add query indexes
+
+Revision ID: 3f9c1b7d2e84
+Revises: a73f2e712c07
+Create Date: 2026-10-18 10:12:41.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c1b7d2e84'
+down_revision = 'a73f2e712c07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # indexes are built concurrently so the tables stay writable while they build,
+    # which postgres only allows outside of a transaction
+    with op.get_context().autocommit_block():
+        # per-entity show lookups filtered on start_time
+        op.create_index('ix_show_venue_id_start_time', 'show', ['venue_id', 'start_time'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_show_artist_id_start_time', 'show', ['artist_id', 'start_time'],
+                        postgresql_concurrently=True)
+        # global upcoming/past filters and the /shows listing
+        op.create_index('ix_show_start_time', 'show', ['start_time'],
+                        postgresql_concurrently=True)
+        # trigram indexes serve the name ILIKE '%term%' searches
+        op.create_index('ix_venue_name_trgm', 'venue', ['name'],
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+        op.create_index('ix_artist_name_trgm', 'artist', ['name'],
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+        # the genre association PKs lead with the entity id, these cover lookups by genre
+        op.create_index('ix_venue_genre_genre', 'venue_genre', ['genre'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_artist_genre_genre', 'artist_genre', ['genre'],
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_artist_genre_genre', table_name='artist_genre')
+    op.drop_index('ix_venue_genre_genre', table_name='venue_genre')
+    op.drop_index('ix_artist_name_trgm', table_name='artist')
+    op.drop_index('ix_venue_name_trgm', table_name='venue')
+    op.drop_index('ix_show_start_time', table_name='show')
+    op.drop_index('ix_show_artist_id_start_time', table_name='show')
+    op.drop_index('ix_show_venue_id_start_time', table_name='show')
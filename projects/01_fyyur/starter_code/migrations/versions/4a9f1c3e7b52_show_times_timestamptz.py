@@ -0,0 +1,156 @@
+"""show times timestamptz
+
+Revision ID: 4a9f1c3e7b52
+Revises: e81b3f6c2a97
+Create Date: 2026-10-18 18:02:13.640517
+
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '4a9f1c3e7b52'
+down_revision = 'e81b3f6c2a97'
+branch_labels = None
+depends_on = None
+
+
+# Converts the show times, stored as timestamps the app read as UTC, to timestamptz.
+# show is partitioned on start_time and postgres can't change the type of a partition key, so it is
+# rebuilt the way e81b3f6c2a97 partitioned it, while the app keeps reading and writing:
+#   1. show_utc gets the partitions of the months of show, bounded at midnight UTC, plus its default
+#   2. a trigger mirrors the inserts and deletes of show into show_utc
+#   3. the rows of every partition of show are copied a committed statement each, then rows a copy
+#      read just before they were deleted are removed again
+#   4. one short transaction swaps the tables. Dropping and renaming show take an ACCESS EXCLUSIVE
+#      lock, which blocks reads as well as writes until the swap commits, so the lock is taken first
+#      with LOCK_TIMEOUT, as e81b3f6c2a97 does: the migration fails rather than queueing every query
+#      of the app behind a long running one, and can be rerun once the new table is dropped
+# show_stats is small and converted in place. The downgrade rebuilds show the same way.
+
+LOCK_TIMEOUT = '5s'
+
+CREATE_TABLE = """
+CREATE TABLE {table} (
+  artist_id uuid NOT NULL,
+  venue_id uuid NOT NULL,
+  start_time {type} NOT NULL,
+  CONSTRAINT {table}_pkey PRIMARY KEY (artist_id, venue_id, start_time),
+  CONSTRAINT {table}_artist_id_fkey FOREIGN KEY (artist_id) REFERENCES artist (id) ON DELETE CASCADE,
+  CONSTRAINT {table}_venue_id_fkey FOREIGN KEY (venue_id) REFERENCES venue (id) ON DELETE CASCADE
+) PARTITION BY RANGE (start_time)
+"""
+
+MIRROR_TRIGGER_FUNCTION = """
+CREATE FUNCTION {table}_mirror() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO {table} VALUES (NEW.artist_id, NEW.venue_id, {new_start_time}) ON CONFLICT DO NOTHING;
+  ELSE
+    DELETE FROM {table}
+     WHERE artist_id = OLD.artist_id AND venue_id = OLD.venue_id AND start_time = {old_start_time};
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+MIRROR_TRIGGER = """
+CREATE TRIGGER {table}_mirror AFTER INSERT OR DELETE ON show
+FOR EACH ROW EXECUTE PROCEDURE {table}_mirror()
+"""
+
+COPY_PARTITION = """
+INSERT INTO {table} SELECT artist_id, venue_id, {start_time} FROM {partition}
+ON CONFLICT DO NOTHING
+"""
+
+RECONCILE = """
+DELETE FROM {table}
+ WHERE NOT EXISTS (SELECT 1 FROM show
+                    WHERE show.artist_id = {table}.artist_id
+                      AND show.venue_id = {table}.venue_id
+                      AND {start_time} = {table}.start_time)
+"""
+
+PARTITIONS = """
+SELECT child.relname FROM pg_inherits
+  JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+ WHERE pg_inherits.inhparent = 'show'::regclass
+"""
+
+INDEXES = {
+    'ix_show_venue_id_start_time': ['venue_id', 'start_time'],
+    'ix_show_artist_id_start_time': ['artist_id', 'start_time'],
+    'ix_show_start_time': ['start_time'],
+}
+
+# Turns a timestamp into the timestamptz of that UTC time, and a timestamptz into its UTC timestamp
+AT_UTC = "{} AT TIME ZONE 'UTC'"
+
+
+def month_bound(month, aware):
+    if aware:
+        return datetime(month.year, month.month, 1, tzinfo=timezone.utc).isoformat(' ')
+    return datetime(month.year, month.month, 1).isoformat(' ')
+
+
+def next_month(month):
+    index = month.year * 12 + month.month
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def rebuild_show(table, column_type, aware):
+    connection = op.get_bind()
+    partitions = [name for (name,) in connection.execute(sa.text(PARTITIONS))]
+    months = [datetime.strptime(name, 'show_y%Ym%m') for name in partitions if name != 'show_default']
+
+    op.execute(CREATE_TABLE.format(table=table, type=column_type))
+    for month in months:
+        op.execute("CREATE TABLE {}_y{:04d}m{:02d} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')".format(
+            table, month.year, month.month, table, month_bound(month, aware), month_bound(next_month(month), aware)))
+    op.execute('CREATE TABLE {0}_default PARTITION OF {0} DEFAULT'.format(table))
+    for name, columns in INDEXES.items():
+        op.create_index('{}_{}'.format(name, table), table, columns)
+    op.execute(MIRROR_TRIGGER_FUNCTION.format(table=table, new_start_time=AT_UTC.format('NEW.start_time'),
+                                              old_start_time=AT_UTC.format('OLD.start_time')))
+    op.execute(MIRROR_TRIGGER.format(table=table))
+
+    with op.get_context().autocommit_block():
+        for partition in partitions:
+            connection.execute(sa.text(COPY_PARTITION.format(
+                table=table, partition=partition, start_time=AT_UTC.format('start_time'))))
+        connection.execute(sa.text(RECONCILE.format(table=table, start_time=AT_UTC.format('show.start_time'))))
+
+    op.execute("SET LOCAL lock_timeout = '{}'".format(LOCK_TIMEOUT))
+    op.execute('LOCK TABLE show IN ACCESS EXCLUSIVE MODE')
+    op.execute('DROP TRIGGER {0}_mirror ON show'.format(table))
+    op.execute('DROP FUNCTION {}_mirror()'.format(table))
+    # dropping show drops its partitions, archived ones were detached and are kept
+    op.drop_table('show')
+    op.rename_table(table, 'show')
+    for month in months:
+        op.execute('ALTER TABLE {}_y{:04d}m{:02d} RENAME TO show_y{:04d}m{:02d}'.format(
+            table, month.year, month.month, month.year, month.month))
+    op.execute('ALTER TABLE {}_default RENAME TO show_default'.format(table))
+    for name in ('pkey', 'artist_id_fkey', 'venue_id_fkey'):
+        op.execute('ALTER TABLE show RENAME CONSTRAINT {0}_{1} TO show_{1}'.format(table, name))
+    for name in INDEXES:
+        op.execute('ALTER INDEX {0}_{1} RENAME TO {0}'.format(name, table))
+
+
+def upgrade():
+    rebuild_show('show_utc', 'timestamp with time zone', aware=True)
+    for column in ('next_show_time', 'last_show_time'):
+        op.alter_column('show_stats', column, type_=postgresql.TIMESTAMP(timezone=True),
+                        postgresql_using=AT_UTC.format(column))
+
+
+def downgrade():
+    for column in ('next_show_time', 'last_show_time'):
+        op.alter_column('show_stats', column, type_=sa.DateTime(), postgresql_using=AT_UTC.format(column))
+    rebuild_show('show_local', 'timestamp without time zone', aware=False)
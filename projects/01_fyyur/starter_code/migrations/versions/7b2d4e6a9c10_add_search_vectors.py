@@ -0,0 +1,107 @@
+"""add search vectors
+
+Revision ID: 7b2d4e6a9c10
+Revises: 3f9c1b7d2e84
+Create Date: 2026-10-18 11:02:17.540982
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2d4e6a9c10'
+down_revision = '3f9c1b7d2e84'
+branch_labels = None
+depends_on = None
+
+
+# Builds the search document of a venue or artist. Names weigh most, then the location, then genres.
+SEARCH_DOCUMENT_FUNCTION = """
+CREATE OR REPLACE FUNCTION fyyur_search_document(name text, city text, state text, genres text)
+RETURNS tsvector AS $$
+  SELECT setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+      || setweight(to_tsvector('simple', coalesce(city, '') || ' ' || coalesce(state, '')), 'B')
+      || setweight(to_tsvector('simple', coalesce(genres, '')), 'C')
+$$ LANGUAGE sql IMMUTABLE
+"""
+
+# The genres of a venue/artist as one space separated string
+GENRE_NAMES = """
+(SELECT string_agg(genre.name, ' ') FROM {table}_genre
+   JOIN genre ON genre.id = {table}_genre.genre
+  WHERE {table}_genre.{table}_id = {id})
+"""
+
+# Recomputes the row's search vector whenever its searchable columns change
+ENTITY_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+BEGIN
+  NEW.search_vector := fyyur_search_document(NEW.name, NEW.city, NEW.state, {genres});
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+ENTITY_TRIGGER = """
+CREATE TRIGGER {table}_search_vector_update
+BEFORE INSERT OR UPDATE OF name, city, state ON {table}
+FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector_update()
+"""
+
+# Refreshes the parent row's search vector when its genres change
+GENRE_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION {table}_genre_search_vector_update() RETURNS trigger AS $$
+DECLARE
+  entity_id text;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    entity_id := OLD.{table}_id;
+  ELSE
+    entity_id := NEW.{table}_id;
+  END IF;
+  UPDATE {table}
+     SET search_vector = fyyur_search_document(name, city, state, {genres})
+   WHERE id = entity_id;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+GENRE_TRIGGER = """
+CREATE TRIGGER {table}_genre_search_vector_update
+AFTER INSERT OR UPDATE OR DELETE ON {table}_genre
+FOR EACH ROW EXECUTE PROCEDURE {table}_genre_search_vector_update()
+"""
+
+BACKFILL = """
+UPDATE {table} SET search_vector = fyyur_search_document(name, city, state, {genres})
+"""
+
+
+def upgrade():
+    op.execute(SEARCH_DOCUMENT_FUNCTION)
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute(ENTITY_TRIGGER_FUNCTION.format(
+            table=table, genres=GENRE_NAMES.format(table=table, id='NEW.id')))
+        op.execute(ENTITY_TRIGGER.format(table=table))
+        op.execute(GENRE_TRIGGER_FUNCTION.format(
+            table=table, genres=GENRE_NAMES.format(table=table, id='entity_id')))
+        op.execute(GENRE_TRIGGER.format(table=table))
+        op.execute(BACKFILL.format(
+            table=table, genres=GENRE_NAMES.format(table=table, id=table + '.id')))
+        op.create_index('ix_{}_search_vector'.format(table), table, ['search_vector'],
+                        postgresql_using='gin')
+
+
+def downgrade():
+    for table in ('artist', 'venue'):
+        op.drop_index('ix_{}_search_vector'.format(table), table_name=table)
+        op.execute('DROP TRIGGER {0}_genre_search_vector_update ON {0}_genre'.format(table))
+        op.execute('DROP FUNCTION {}_genre_search_vector_update()'.format(table))
+        op.execute('DROP TRIGGER {0}_search_vector_update ON {0}'.format(table))
+        op.execute('DROP FUNCTION {}_search_vector_update()'.format(table))
+        op.drop_column(table, 'search_vector')
+    op.execute('DROP FUNCTION fyyur_search_document(text, text, text, text)')
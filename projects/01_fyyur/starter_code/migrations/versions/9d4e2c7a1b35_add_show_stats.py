@@ -0,0 +1,51 @@
+"""add show stats
+
+Revision ID: 9d4e2c7a1b35
+Revises: 7b2d4e6a9c10
+Create Date: 2026-10-18 14:37:52.106384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4e2c7a1b35'
+down_revision = '7b2d4e6a9c10'
+branch_labels = None
+depends_on = None
+
+
+# Computes the stats of every venue/artist with shows, the app then keeps them up to date.
+# Show times are UTC timestamps, compared with the current UTC time whatever the session time zone.
+BACKFILL = """
+INSERT INTO show_stats (entity_type, entity_id, upcoming_count, past_count, next_show_time, last_show_time)
+SELECT '{entity_type}', {entity_type}_id,
+       count(*) FILTER (WHERE start_time > now() AT TIME ZONE 'UTC'),
+       count(*) FILTER (WHERE start_time <= now() AT TIME ZONE 'UTC'),
+       min(start_time) FILTER (WHERE start_time > now() AT TIME ZONE 'UTC'),
+       max(start_time) FILTER (WHERE start_time <= now() AT TIME ZONE 'UTC')
+  FROM show
+ GROUP BY {entity_type}_id
+"""
+
+
+def upgrade():
+    op.create_table('show_stats',
+    sa.Column('entity_type', sa.String(length=6), nullable=False),
+    sa.Column('entity_id', sa.String(), nullable=False),
+    sa.Column('upcoming_count', sa.Integer(), nullable=False),
+    sa.Column('past_count', sa.Integer(), nullable=False),
+    sa.Column('next_show_time', sa.DateTime(), nullable=True),
+    sa.Column('last_show_time', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('entity_type', 'entity_id')
+    )
+    # stale rows are found by their next show time, see `flask roll-show-stats`
+    op.create_index('ix_show_stats_next_show_time', 'show_stats', ['next_show_time'])
+    for entity_type in ('venue', 'artist'):
+        op.execute(BACKFILL.format(entity_type=entity_type))
+
+
+def downgrade():
+    op.drop_index('ix_show_stats_next_show_time', table_name='show_stats')
+    op.drop_table('show_stats')
@@ -0,0 +1,187 @@
+"""native uuid ids
+
+Revision ID: c2a7e5f41d08
+Revises: 9d4e2c7a1b35
+Create Date: 2026-10-18 16:05:29.713840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2a7e5f41d08'
+down_revision = '9d4e2c7a1b35'
+branch_labels = None
+depends_on = None
+
+
+# Converts the venue/artist ids and every column holding them from text to the native uuid type,
+# while the app keeps reading and writing:
+#   1. every id column gets a uuid twin, kept in sync with the text column by a trigger
+#   2. existing rows are backfilled in primary key order, BATCH_SIZE rows per committed UPDATE
+#   3. the future primary key and lookup indexes are built concurrently, and NOT NULL is proven
+#      with validated CHECK constraints, so none of them blocks writes
+#   4. one short transaction swaps the columns and turns the indexes into the primary keys
+#   5. foreign keys are added NOT VALID in that transaction and validated afterwards
+# The downgrade converts the columns back in place, locking the tables while it runs.
+
+BATCH_SIZE = 10000
+
+# {table: (primary key columns, id columns converted)}
+TABLES = {
+    'venue': (['id'], ['id']),
+    'artist': (['id'], ['id']),
+    'show': (['artist_id', 'venue_id', 'start_time'], ['artist_id', 'venue_id']),
+    'venue_genre': (['venue_id', 'genre'], ['venue_id']),
+    'artist_genre': (['artist_id', 'genre'], ['artist_id']),
+    'show_stats': (['entity_type', 'entity_id'], ['entity_id']),
+}
+
+# (table, columns) of the other indexes on id columns
+LOOKUP_INDEXES = {
+    'ix_show_venue_id_start_time': ('show', ['venue_id', 'start_time']),
+    'ix_show_artist_id_start_time': ('show', ['artist_id', 'start_time']),
+}
+
+# (name, table, column, referenced table)
+FOREIGN_KEYS = [
+    ('show_artist_id_fkey', 'show', 'artist_id', 'artist'),
+    ('show_venue_id_fkey', 'show', 'venue_id', 'venue'),
+    ('venue_genre_venue_id_fkey', 'venue_genre', 'venue_id', 'venue'),
+    ('artist_genre_artist_id_fkey', 'artist_genre', 'artist_id', 'artist'),
+]
+
+SYNC_TRIGGER_FUNCTION = """
+CREATE FUNCTION {table}_uuid_sync() RETURNS trigger AS $$
+BEGIN
+  {assignments}
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+SYNC_TRIGGER = """
+CREATE TRIGGER {table}_uuid_sync BEFORE INSERT OR UPDATE ON {table}
+FOR EACH ROW EXECUTE PROCEDURE {table}_uuid_sync()
+"""
+
+# Updates the next batch of rows after the last primary key of the previous batch and returns the
+# last primary key of this batch, data modifying CTEs always run to completion
+BACKFILL_BATCH = """
+WITH batch AS (
+  SELECT {key} FROM {table} {after} ORDER BY {key} LIMIT {batch_size}
+), updated AS (
+  UPDATE {table} SET {assignments} FROM batch WHERE {batch_match}
+)
+SELECT {key} FROM batch ORDER BY {key} DESC LIMIT 1
+"""
+
+# The genre triggers of the add_search_vectors migration hold the id in a text variable, which
+# no longer compares with uuid ids. %TYPE follows the id column whatever its type.
+GENRE_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION {table}_genre_search_vector_update() RETURNS trigger AS $$
+DECLARE
+  entity_id {table}.id%TYPE;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    entity_id := OLD.{table}_id;
+  ELSE
+    entity_id := NEW.{table}_id;
+  END IF;
+  UPDATE {table}
+     SET search_vector = fyyur_search_document(name, city, state,
+           (SELECT string_agg(genre.name, ' ') FROM {table}_genre
+              JOIN genre ON genre.id = {table}_genre.genre
+             WHERE {table}_genre.{table}_id = entity_id))
+   WHERE id = entity_id;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def twin(column):
+    return column + '_uuid'
+
+
+def backfill(connection, table, key_columns, columns):
+    key = ', '.join(key_columns)
+    assignments = ', '.join('{} = {}::uuid'.format(twin(column), column) for column in columns)
+    batch_match = ' AND '.join('{0}.{1} = batch.{1}'.format(table, column) for column in key_columns)
+    last = None
+    while True:
+        after = ''
+        parameters = {}
+        if last is not None:
+            after = 'WHERE ({}) > ({})'.format(key, ', '.join(':key_{}'.format(index) for index in range(len(last))))
+            parameters = dict(('key_{}'.format(index), value) for index, value in enumerate(last))
+        last = connection.execute(sa.text(BACKFILL_BATCH.format(
+            table=table, key=key, after=after, batch_size=BATCH_SIZE, assignments=assignments,
+            batch_match=batch_match)), parameters).first()
+        if last is None:
+            break
+
+
+def upgrade():
+    for table, (key_columns, columns) in TABLES.items():
+        for column in columns:
+            op.add_column(table, sa.Column(twin(column), postgresql.UUID(), nullable=True))
+        op.execute(SYNC_TRIGGER_FUNCTION.format(table=table, assignments='\n  '.join(
+            'NEW.{} := NEW.{}::uuid;'.format(twin(column), column) for column in columns)))
+        op.execute(SYNC_TRIGGER.format(table=table))
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        for table, (key_columns, columns) in TABLES.items():
+            backfill(connection, table, key_columns, columns)
+        for table, (key_columns, columns) in TABLES.items():
+            op.create_index(table + '_uuid_pkey', table,
+                            [twin(column) if column in columns else column for column in key_columns],
+                            unique=True, postgresql_concurrently=True)
+            for column in columns:
+                # a validated CHECK lets SET NOT NULL skip its full table scan
+                op.execute('ALTER TABLE {0} ADD CONSTRAINT {0}_{1}_not_null CHECK ({1} IS NOT NULL) NOT VALID'
+                           .format(table, twin(column)))
+                op.execute('ALTER TABLE {0} VALIDATE CONSTRAINT {0}_{1}_not_null'.format(table, twin(column)))
+        for name, (table, columns) in LOOKUP_INDEXES.items():
+            op.create_index(name + '_uuid', table, [twin(columns[0])] + columns[1:],
+                            postgresql_concurrently=True)
+
+    # the swap, metadata changes only
+    for name, table, column, referenced_table in FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_='foreignkey')
+    for table, (key_columns, columns) in TABLES.items():
+        op.drop_constraint(table + '_pkey', table, type_='primary')
+        op.execute('DROP TRIGGER {0}_uuid_sync ON {0}'.format(table))
+        op.execute('DROP FUNCTION {}_uuid_sync()'.format(table))
+        for column in columns:
+            # dropping the text column drops the lookup indexes built on it
+            op.drop_column(table, column)
+            op.alter_column(table, twin(column), new_column_name=column)
+            op.alter_column(table, column, nullable=False)
+            op.drop_constraint('{}_{}_not_null'.format(table, twin(column)), table, type_='check')
+        op.execute('ALTER TABLE {0} ADD CONSTRAINT {0}_pkey PRIMARY KEY USING INDEX {0}_uuid_pkey'.format(table))
+    for name in LOOKUP_INDEXES:
+        op.execute('ALTER INDEX {0}_uuid RENAME TO {0}'.format(name))
+    for name, table, column, referenced_table in FOREIGN_KEYS:
+        op.execute('ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY ({}) REFERENCES {} (id) ON DELETE CASCADE NOT VALID'
+                   .format(table, name, column, referenced_table))
+    for table in ('venue', 'artist'):
+        op.execute(GENRE_TRIGGER_FUNCTION.format(table=table))
+
+    with op.get_context().autocommit_block():
+        for name, table, column, referenced_table in FOREIGN_KEYS:
+            op.execute('ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(table, name))
+
+
+def downgrade():
+    for name, table, column, referenced_table in FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_='foreignkey')
+    for table, (key_columns, columns) in TABLES.items():
+        for column in columns:
+            op.alter_column(table, column, type_=sa.String(length=120) if column == 'id' else sa.String(),
+                            postgresql_using='{}::text'.format(column))
+    for name, table, column, referenced_table in FOREIGN_KEYS:
+        op.create_foreign_key(name, table, referenced_table, [column], ['id'], ondelete='CASCADE')
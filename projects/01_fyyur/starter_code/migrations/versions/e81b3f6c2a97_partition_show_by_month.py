@@ -0,0 +1,161 @@
+"""partition show by month
+
+Revision ID: e81b3f6c2a97
+Revises: c2a7e5f41d08
+Create Date: 2026-10-18 17:21:44.508127
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b3f6c2a97'
+down_revision = 'c2a7e5f41d08'
+branch_labels = None
+depends_on = None
+
+
+# Replaces show with a copy range partitioned by month on start_time, see partitions.py, while the
+# app keeps reading and writing:
+#   1. show_partitioned gets the partitions of every month from the oldest show to
+#      MONTHS_AHEAD months from now, plus show_default for the rows outside them
+#   2. a trigger mirrors the inserts and deletes of show into show_partitioned
+#   3. the rows are copied a month per committed statement, then rows a copy read just before
+#      they were deleted are removed again
+#   4. one short transaction swaps the tables. Dropping and renaming show take an ACCESS EXCLUSIVE
+#      lock, which blocks reads as well as writes until the swap commits, so the lock is taken first
+#      with LOCK_TIMEOUT: rather than waiting behind a long query, with every query of the app
+#      queued behind it, the migration fails and can be rerun once show_partitioned is dropped
+# The downgrade copies the rows back into a plain table, blocking writes to show while it runs and
+# reads too once it drops show.
+
+MONTHS_AHEAD = 12
+LOCK_TIMEOUT = '5s'
+
+CREATE_PARTITIONED = """
+CREATE TABLE show_partitioned (
+  artist_id uuid NOT NULL,
+  venue_id uuid NOT NULL,
+  start_time timestamp without time zone NOT NULL,
+  CONSTRAINT show_partitioned_pkey PRIMARY KEY (artist_id, venue_id, start_time),
+  CONSTRAINT show_partitioned_artist_id_fkey FOREIGN KEY (artist_id) REFERENCES artist (id) ON DELETE CASCADE,
+  CONSTRAINT show_partitioned_venue_id_fkey FOREIGN KEY (venue_id) REFERENCES venue (id) ON DELETE CASCADE
+) PARTITION BY RANGE (start_time)
+"""
+
+MIRROR_TRIGGER_FUNCTION = """
+CREATE FUNCTION show_partitioned_mirror() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO show_partitioned VALUES (NEW.artist_id, NEW.venue_id, NEW.start_time) ON CONFLICT DO NOTHING;
+  ELSE
+    DELETE FROM show_partitioned
+     WHERE artist_id = OLD.artist_id AND venue_id = OLD.venue_id AND start_time = OLD.start_time;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+MIRROR_TRIGGER = """
+CREATE TRIGGER show_partitioned_mirror AFTER INSERT OR DELETE ON show
+FOR EACH ROW EXECUTE PROCEDURE show_partitioned_mirror()
+"""
+
+COPY_RANGE = """
+INSERT INTO show_partitioned SELECT artist_id, venue_id, start_time FROM show
+ WHERE start_time >= :lower AND start_time < :upper
+ON CONFLICT DO NOTHING
+"""
+
+COPY_OUTSIDE = """
+INSERT INTO show_partitioned SELECT artist_id, venue_id, start_time FROM show
+ WHERE start_time < :lower OR start_time >= :upper
+ON CONFLICT DO NOTHING
+"""
+
+RECONCILE = """
+DELETE FROM show_partitioned
+ WHERE NOT EXISTS (SELECT 1 FROM show
+                    WHERE show.artist_id = show_partitioned.artist_id
+                      AND show.venue_id = show_partitioned.venue_id
+                      AND show.start_time = show_partitioned.start_time)
+"""
+
+INDEXES = {
+    'ix_show_venue_id_start_time': ['venue_id', 'start_time'],
+    'ix_show_artist_id_start_time': ['artist_id', 'start_time'],
+    'ix_show_start_time': ['start_time'],
+}
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def months_between(first, last):
+    month = datetime(first.year, first.month, 1)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def upgrade():
+    connection = op.get_bind()
+    now = datetime.today()
+    oldest = connection.execute(sa.text('SELECT min(start_time) FROM show')).scalar() or now
+    months = list(months_between(min(oldest, now), add_months(datetime(now.year, now.month, 1), MONTHS_AHEAD)))
+
+    op.execute(CREATE_PARTITIONED)
+    for month in months:
+        op.execute("CREATE TABLE show_y{:04d}m{:02d} PARTITION OF show_partitioned FOR VALUES FROM ('{}') TO ('{}')"
+                   .format(month.year, month.month, month.isoformat(' '), add_months(month, 1).isoformat(' ')))
+    op.execute('CREATE TABLE show_default PARTITION OF show_partitioned DEFAULT')
+    # indexes on a partitioned table are created on every partition
+    for name, columns in INDEXES.items():
+        op.create_index(name + '_partitioned', 'show_partitioned', columns)
+    op.execute(MIRROR_TRIGGER_FUNCTION)
+    op.execute(MIRROR_TRIGGER)
+
+    with op.get_context().autocommit_block():
+        for month in months:
+            connection.execute(sa.text(COPY_RANGE), {'lower': month, 'upper': add_months(month, 1)})
+        connection.execute(sa.text(COPY_OUTSIDE), {'lower': months[0], 'upper': add_months(months[-1], 1)})
+        connection.execute(sa.text(RECONCILE))
+
+    op.execute("SET LOCAL lock_timeout = '{}'".format(LOCK_TIMEOUT))
+    op.execute('LOCK TABLE show IN ACCESS EXCLUSIVE MODE')
+    op.execute('DROP TRIGGER show_partitioned_mirror ON show')
+    op.execute('DROP FUNCTION show_partitioned_mirror()')
+    op.drop_table('show')
+    op.rename_table('show_partitioned', 'show')
+    for name in ('pkey', 'artist_id_fkey', 'venue_id_fkey'):
+        op.execute('ALTER TABLE show RENAME CONSTRAINT show_partitioned_{0} TO show_{0}'.format(name))
+    for name in INDEXES:
+        op.execute('ALTER INDEX {0}_partitioned RENAME TO {0}'.format(name))
+
+
+def downgrade():
+    op.execute("SET LOCAL lock_timeout = '{}'".format(LOCK_TIMEOUT))
+    op.execute('LOCK TABLE show IN EXCLUSIVE MODE')
+    op.create_table('show_unpartitioned',
+    sa.Column('artist_id', postgresql.UUID(), nullable=False),
+    sa.Column('venue_id', postgresql.UUID(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], name='show_unpartitioned_artist_id_fkey', ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['venue.id'], name='show_unpartitioned_venue_id_fkey', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('artist_id', 'venue_id', 'start_time', name='show_unpartitioned_pkey')
+    )
+    op.execute('INSERT INTO show_unpartitioned SELECT artist_id, venue_id, start_time FROM show')
+    # dropping show drops its partitions, archived ones were detached and are kept
+    op.drop_table('show')
+    op.rename_table('show_unpartitioned', 'show')
+    for name in ('pkey', 'artist_id_fkey', 'venue_id_fkey'):
+        op.execute('ALTER TABLE show RENAME CONSTRAINT show_unpartitioned_{0} TO show_{0}'.format(name))
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'show', columns)
@@ -0,0 +1,96 @@
+import re
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+# Monthly range partitions of the show table, on PostgreSQL.
+# show is partitioned by start_time with one partition per calendar month, named show_yYYYYmMM,
+# plus show_default, which takes the rows no month partition covers so inserts never fail.
+# Queries filtering on start_time, e.x. upcoming shows, only scan the partitions of the months
+# they can match.
+#   `flask create-show-partitions`, run periodically, creates the partitions of the coming
+#   SHOW_PARTITION_MONTHS_AHEAD months and moves the rows that landed in show_default into them.
+#   `flask archive-shows` detaches the partitions of months that ended more than
+#   SHOW_ARCHIVE_AFTER_MONTHS months ago and moves them to the SHOW_ARCHIVE_SCHEMA schema, where
+#   the app no longer reads them and they can be dumped or dropped.
+
+DEFAULT_PARTITION = 'show_default'
+PARTITION_NAME = re.compile(r'^show_y(\d{4})m(\d{2})$')
+
+# Months start at midnight UTC, partition bounds are the same instants whatever the session's TimeZone
+def month_start(value):
+  return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+def add_months(month, months):
+  index = month.year * 12 + month.month - 1 + months
+  return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+def partition_name(month):
+  return 'show_y{:04d}m{:02d}'.format(month.year, month.month)
+
+def is_partitioned(connection):
+  if connection.dialect.name != 'postgresql':
+    return False
+  return connection.execute(text("SELECT relkind FROM pg_class WHERE oid = 'show'::regclass")).scalar() == 'p'
+
+# Returns {partition name: first day of its month} of the month partitions of show
+def month_partitions(connection):
+  names = connection.execute(text("""
+    SELECT child.relname FROM pg_inherits
+      JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+     WHERE pg_inherits.inhparent = 'show'::regclass"""))
+  partitions = {}
+  for (name,) in names:
+    match = PARTITION_NAME.match(name)
+    if match:
+      partitions[name] = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+  return partitions
+
+# Creates the partition of month. Postgres refuses to attach a range that show_default still holds
+# rows of, so they are moved into the new table before it is attached.
+def create_month_partition(connection, month):
+  name = partition_name(month)
+  lower, upper = month, add_months(month, 1)
+  connection.execute(text('CREATE TABLE {} (LIKE show INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(name)))
+  connection.execute(text("""
+    WITH moved AS (
+      DELETE FROM {default} WHERE start_time >= :lower AND start_time < :upper RETURNING *
+    )
+    INSERT INTO {name} SELECT * FROM moved""".format(default=DEFAULT_PARTITION, name=name)),
+    {'lower': lower, 'upper': upper})
+  connection.execute(text("ALTER TABLE show ATTACH PARTITION {} FOR VALUES FROM ('{}') TO ('{}')".format(
+    name, lower.isoformat(' '), upper.isoformat(' '))))
+  return name
+
+# Creates the missing partitions from the month of now to months_ahead months later and returns
+# their names
+def create_show_partitions(connection, now, months_ahead):
+  existing = month_partitions(connection)
+  created = []
+  for offset in range(months_ahead + 1):
+    month = add_months(month_start(now), offset)
+    if partition_name(month) not in existing:
+      created.append(create_month_partition(connection, month))
+  return created
+
+# Returns the names of the partitions of months that ended at or before horizon, oldest first
+def expired_partitions(connection, horizon):
+  partitions = month_partitions(connection)
+  return sorted((name for name, month in partitions.items() if add_months(month, 1) <= horizon),
+                key=partitions.get)
+
+# Returns ({venue ids}, {artist ids}) of the shows of the given partitions
+def partition_entities(connection, names):
+  venue_ids, artist_ids = set(), set()
+  for name in names:
+    for venue_id, artist_id in connection.execute(text('SELECT DISTINCT venue_id, artist_id FROM ' + name)):
+      venue_ids.add(str(venue_id))
+      artist_ids.add(str(artist_id))
+  return venue_ids, artist_ids
+
+# Detaches the given partitions from show and moves them to schema
+def archive_partitions(connection, names, schema):
+  connection.execute(text('CREATE SCHEMA IF NOT EXISTS ' + schema))
+  for name in names:
+    connection.execute(text('ALTER TABLE show DETACH PARTITION ' + name))
+    connection.execute(text('ALTER TABLE {} SET SCHEMA {}'.format(name, schema)))
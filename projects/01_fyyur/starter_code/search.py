@@ -0,0 +1,54 @@
+import re
+from sqlalchemy import func, or_
+
+# Venue and artist search.
+# On postgres every venue/artist row carries a search_vector tsvector (name, city, state and genres)
+# that is kept up to date by triggers, see the add_search_vectors migration.
+# Searches match it with a prefix tsquery, so typing "mus" already finds "The Musical Hop",
+# and still match partial names with ILIKE, which the trigram index on name serves.
+# Other databases fall back to the ILIKE name match alone.
+
+# Turns free text into a tsquery matching every word as a prefix, e.x. "musical h" -> "musical:* & h:*"
+# Returns an empty string when the text has no searchable words.
+def build_prefix_tsquery(search_term):
+  words = re.findall(r'\w+', search_term.lower())
+  return ' & '.join(word + ':*' for word in words)
+
+# Escapes the LIKE wildcards of a search term so they are matched literally
+def escape_like(search_term):
+  return search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Returns the filter matching search_term on a Venue or Artist model, and the tsquery ranking the
+# matches, None where only names are matched
+def search_match(db, Model, search_term):
+  name_match = Model.name.ilike('%' + escape_like(search_term) + '%', escape='\\')
+  tsquery = build_prefix_tsquery(search_term)
+  if db.engine.dialect.name != 'postgresql' or not tsquery:
+    return name_match, None
+  ts_query = func.to_tsquery('simple', tsquery)
+  return or_(Model.search_vector.op('@@')(ts_query), name_match), ts_query
+
+# Given a Venue or Artist model and a search term, return up to limit (id, name) rows,
+# best matches first.
+# Ranking reads the search_vector of every match it orders, so only the first match_limit matches
+# found are ranked: a broad term, e.x. "the", costs as much as one matching match_limit rows.
+def search_entities(db, Model, search_term, limit, match_limit=None):
+  match, ts_query = search_match(db, Model, search_term)
+  if ts_query is None:
+    return db.session.query(Model.id, Model.name).filter(match).order_by(Model.name, Model.id).limit(limit).all()
+  candidates = db.session.query(Model.id, Model.name, Model.search_vector).filter(match)
+  if match_limit is not None:
+    candidates = candidates.limit(match_limit)
+  candidates = candidates.subquery()
+  rank = func.ts_rank(candidates.c.search_vector, ts_query)
+  return db.session.query(candidates.c.id, candidates.c.name)\
+                   .order_by(rank.desc(), candidates.c.name, candidates.c.id)\
+                   .limit(limit)\
+                   .all()
+
+# Returns the number of rows matching search_term, however many search_entities returns, counting
+# at most limit + 1 of them: more than limit means "limit+"
+def count_search_results(db, Model, search_term, limit):
+  match, ts_query = search_match(db, Model, search_term)
+  matches = db.session.query(Model.id).filter(match).limit(limit + 1).subquery()
+  return db.session.query(func.count()).select_from(matches).scalar()
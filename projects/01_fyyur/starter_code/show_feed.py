@@ -0,0 +1,146 @@
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+import dateutil.parser
+
+from database import as_utc, parse_guid, utc_now
+from helper_functions import decode_cursor, encode_cursor
+
+# The upcoming shows listed on /shows, precomputed in memory.
+# A background thread loads every upcoming show with its artist and venue names, ordered by
+# (start_time, artist_id, venue_id), into a snapshot: an array of start times, in microseconds, and
+# a list of compact rows with the artist and venue details shared between their shows. Pages are
+# found by bisecting the start times, so serving one costs O(log n + page size) whatever the number
+# of shows. Shows that started since the last refresh are skipped the same way.
+# The thread refreshes the snapshot every SHOW_FEED_REFRESH_SECONDS, and as soon as possible after a
+# write to shows, venues or artists of this process, see request_refresh. Writes of other processes
+# show up within the refresh interval.
+# The thread is started by the first request reading the feed, so forked servers start one per
+# worker and CLI commands none. With SHOW_FEED_REFRESH_SECONDS 0 there is no thread: the request
+# reading the feed reloads it itself when a write asked for it, e.x. while benchmarking, where the
+# queries of a thread would be counted against the request being measured.
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def to_microseconds(value):
+  delta = as_utc(value) - EPOCH
+  return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+# Returns the upcoming shows as (start_time, artist_id, venue_id, (artist_name, artist_image_link),
+# venue_name) rows, in feed order
+def load_upcoming_shows(db, Show, Venue, Artist, now):
+  shows = db.session.query(Show.start_time, Show.artist_id, Show.venue_id,
+                           Artist.name, Artist.image_link, Venue.name)\
+                    .join(Artist, Artist.id == Show.artist_id)\
+                    .join(Venue, Venue.id == Show.venue_id)\
+                    .filter(Show.start_time > now)\
+                    .order_by(Show.start_time, Show.artist_id, Show.venue_id)\
+                    .yield_per(10000)
+  artists = {}
+  venues = {}
+  rows = []
+  for start_time, artist_id, venue_id, artist_name, artist_image_link, venue_name in shows:
+    artist = artists.setdefault(artist_id, (artist_name, artist_image_link))
+    venue_name = venues.setdefault(venue_id, venue_name)
+    rows.append((start_time, artist_id, venue_id, artist, venue_name))
+  return rows
+
+class FeedSnapshot(object):
+  def __init__(self, rows):
+    self.start_times = array('q', (to_microseconds(row[0]) for row in rows))
+    self.rows = rows
+
+  # Index of the first show starting after now
+  def first_upcoming(self, now):
+    return bisect_right(self.start_times, to_microseconds(now))
+
+  # Index of the first show sorting after (start_time, artist_id, venue_id)
+  def after(self, start_time, artist_id, venue_id):
+    start = to_microseconds(start_time)
+    index = bisect_left(self.start_times, start)
+    while (index < len(self.rows) and self.start_times[index] == start
+           and (self.rows[index][1], self.rows[index][2]) <= (artist_id, venue_id)):
+      index += 1
+    return index
+
+class ShowFeed(object):
+  def __init__(self, app, load):
+    self.app = app
+    self.load = load
+    self.snapshot = None
+    self._thread = None
+    self._lock = threading.Lock()
+    self._wake = threading.Event()
+    self._loaded = threading.Event()
+
+  def start(self):
+    with self._lock:
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='fyyur-show-feed', daemon=True)
+        self._thread.start()
+
+  @property
+  def interval(self):
+    return self.app.config['SHOW_FEED_REFRESH_SECONDS']
+
+  # Asks the thread to reload the feed without waiting for the interval, returns immediately
+  def request_refresh(self):
+    self._wake.set()
+
+  def refresh(self):
+    now = utc_now()
+    with self.app.app_context():
+      rows = self.load(now)
+    self.snapshot = FeedSnapshot(rows)
+
+  def _run(self):
+    while True:
+      try:
+        self.refresh()
+      except Exception:
+        logging.exception('Error in show feed refresh')
+      self._loaded.set()
+      self._wake.wait(self.interval)
+      self._wake.clear()
+
+  # Returns a page of at most page_size shows starting after now and sorting after cursor, as dicts
+  # with the fields of the /shows tiles, along with the cursor of the next page (None on the last page).
+  # Cursors are those of paginate_keyset, a missing or malformed one starts at the first page.
+  def page(self, now, cursor, page_size):
+    if self.interval:
+      self.start()
+      self._loaded.wait()
+    elif self.snapshot is None or self._wake.is_set():
+      # in the request's own app context and session
+      self._wake.clear()
+      self.snapshot = FeedSnapshot(self.load(utc_now()))
+    snapshot = self.snapshot
+    if snapshot is None:
+      raise RuntimeError('The show feed could not be loaded, see the error log')
+    start = snapshot.first_upcoming(now)
+    values = decode_cursor(cursor)
+    if values is not None and len(values) == 3 and all(isinstance(value, str) for value in values):
+      artist_id, venue_id = parse_guid(values[1]), parse_guid(values[2])
+      try:
+        start_time = dateutil.parser.parse(values[0])
+      except (ValueError, OverflowError):
+        start_time = None
+      if start_time is not None and artist_id is not None and venue_id is not None:
+        start = max(start, snapshot.after(start_time, artist_id, venue_id))
+    rows = snapshot.rows[start:start + page_size + 1]
+    shows = [{
+      'venue_id': venue_id,
+      'venue_name': venue_name,
+      'artist_id': artist_id,
+      'artist_name': artist[0],
+      'artist_image_link': artist[1],
+      'start_time': start_time.isoformat()
+    } for start_time, artist_id, venue_id, artist, venue_name in rows[:page_size]]
+    next_cursor = None
+    if len(rows) > page_size:
+      start_time, artist_id, venue_id = rows[page_size - 1][:3]
+      next_cursor = encode_cursor([start_time, artist_id, venue_id])
+    return shows, next_cursor
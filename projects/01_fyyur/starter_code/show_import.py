@@ -0,0 +1,137 @@
+import csv
+import io
+from itertools import islice
+
+import dateutil.parser
+
+from booking import load_booking_index, lock_booking_entities
+from database import as_utc, parse_guid
+from helper_functions import insert_ignoring_duplicates
+
+# Bulk show import.
+# Rows are dicts with artist_id, venue_id and start_time, read from JSON or CSV.
+# They are processed in batches: each batch is validated, its artist and venue ids are resolved
+# with one query per table, and the valid rows are written with a multi-row
+# INSERT ... ON CONFLICT DO NOTHING, committed per batch. Invalid rows are reported with their
+# 1-based position in the input and never abort the rest of the import.
+# Rows conflicting with a show of their venue or artist, already booked or earlier in the import,
+# are reported too, see booking.py. The batch locks its venues and artists and checks its rows
+# against a BookingIndex of their shows, loaded with one query.
+
+REQUIRED_FIELDS = ('artist_id', 'venue_id', 'start_time')
+
+# Reads import rows from a CSV text stream with an artist_id,venue_id,start_time header
+def read_csv_rows(stream):
+  return csv.DictReader(stream)
+
+# Reads import rows from an uploaded CSV file (bytes)
+def read_csv_upload(file_storage):
+  return read_csv_rows(io.TextIOWrapper(file_storage.stream, encoding='utf-8'))
+
+# Given a raw row, return a tuple in the form (show_values, error_message)
+def validate_row(row):
+  if not isinstance(row, dict):
+    return None, 'row must be an object with ' + ', '.join(REQUIRED_FIELDS)
+  missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+  if missing:
+    return None, 'missing ' + ', '.join(missing)
+  try:
+    # times without a timezone are taken as UTC
+    start_time = as_utc(dateutil.parser.parse(str(row['start_time'])))
+  except (ValueError, OverflowError):
+    return None, 'invalid start_time ' + repr(row['start_time'])
+  artist_id = parse_guid(row['artist_id'])
+  if artist_id is None:
+    return None, 'invalid artist_id ' + repr(row['artist_id'])
+  venue_id = parse_guid(row['venue_id'])
+  if venue_id is None:
+    return None, 'invalid venue_id ' + repr(row['venue_id'])
+  return {
+    'artist_id': artist_id,
+    'venue_id': venue_id,
+    'start_time': start_time
+  }, None
+
+# Returns the subset of ids that exist in Model's table
+def existing_ids(db, Model, ids):
+  if len(ids) == 0:
+    return set()
+  return set(entity_id for (entity_id,) in db.session.query(Model.id).filter(Model.id.in_(ids)))
+
+# Imports rows and returns a report in the form
+# {"received": n, "imported": n, "duplicates": n, "errors": [{"row": n, "error": "..."}]}
+# before_commit, when given, is called with the list of shows of each batch once they are inserted,
+# in the batch's transaction: what it writes commits with the shows, and a batch it fails fails whole.
+# show_duration is the timedelta a show books its venue and artist for, None skips the booking checks.
+def import_shows(db, Show, Artist, Venue, rows, batch_size=1000, before_commit=None, show_duration=None):
+  report = {"received": 0, "imported": 0, "duplicates": 0, "errors": []}
+  rows = iter(rows)
+  while True:
+    batch = list(islice(rows, batch_size))
+    if len(batch) == 0:
+      break
+    first_row_number = report["received"] + 1
+    report["received"] += len(batch)
+
+    valid = []
+    for row_number, row in enumerate(batch, first_row_number):
+      show, error = validate_row(row)
+      if error:
+        report["errors"].append({"row": row_number, "error": error})
+      else:
+        valid.append((row_number, show))
+
+    artist_ids = existing_ids(db, Artist, set(show['artist_id'] for _, show in valid))
+    venue_ids = existing_ids(db, Venue, set(show['venue_id'] for _, show in valid))
+    known = []
+    for row_number, show in valid:
+      if show['artist_id'] not in artist_ids:
+        report["errors"].append({"row": row_number, "error": 'unknown artist_id ' + show['artist_id']})
+      elif show['venue_id'] not in venue_ids:
+        report["errors"].append({"row": row_number, "error": 'unknown venue_id ' + show['venue_id']})
+      else:
+        known.append((row_number, show))
+
+    bookings = None
+    if show_duration is not None and len(known) > 0:
+      lock_booking_entities(db, Venue, Artist, venue_ids, artist_ids)
+      start_times = [show['start_time'] for _, show in known]
+      bookings = load_booking_index(db, Show, venue_ids, artist_ids, min(start_times), max(start_times),
+                                    show_duration)
+    shows = []
+    show_row_numbers = []
+    seen = set()
+    for row_number, show in known:
+      key = (show['venue_id'], show['artist_id'], show['start_time'])
+      if key in seen or (bookings is not None and key in bookings):
+        report["duplicates"] += 1
+        continue
+      if bookings is not None:
+        conflict = bookings.conflict(show['venue_id'], show['artist_id'], show['start_time'])
+        if conflict is not None:
+          report["errors"].append({"row": row_number, "error": str(conflict)})
+          continue
+        bookings.add(show['venue_id'], show['artist_id'], show['start_time'])
+      seen.add(key)
+      shows.append(show)
+      show_row_numbers.append(row_number)
+
+    if len(shows) == 0:
+      # releases the locks of the booking checks
+      db.session.rollback()
+      continue
+    try:
+      # a single multi-row statement, so rowcount is the number of rows actually inserted
+      inserted = db.session.execute(insert_ignoring_duplicates(db, Show.__table__).values(shows)).rowcount
+      if before_commit is not None:
+        before_commit(shows)
+      db.session.commit()
+    except Exception as e:
+      db.session.rollback()
+      message = 'batch failed: ' + str(e).splitlines()[0]
+      report["errors"].extend({"row": row_number, "error": message} for row_number in show_row_numbers)
+      continue
+    report["imported"] += inserted
+    report["duplicates"] += len(shows) - inserted
+  report["errors"].sort(key=lambda error: error["row"])
+  return report
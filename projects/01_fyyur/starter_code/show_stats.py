@@ -0,0 +1,146 @@
+from sqlalchemy import case, delete, func, literal, or_, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Show statistics of every venue and artist, kept in the show_stats table so listings and searches
+# read one row per entity instead of aggregating its shows on every request.
+#
+# Creating a show updates the rows of its venue and artist in place, deleting one recomputes them.
+# Bulk writes skip the mapper events, so they refresh the rows of the entities they touched.
+# Shows move from upcoming to past as time goes by, which no write reports: a row whose
+# next_show_time has passed is stale. `flask roll-show-stats`, run periodically, recomputes stale
+# rows, and reads recompute them in memory until it does, so counts are right in between.
+
+# Entity ids per statement when refreshing many entities
+REFRESH_CHUNK_SIZE = 500
+
+# Returns the INSERT of table supporting ON CONFLICT clauses, or None when the database has none
+def on_conflict_insert(dialect_name, table):
+  if dialect_name == 'postgresql':
+    return postgresql.insert(table)
+  elif dialect_name == 'sqlite':
+    return sqlite.insert(table)
+  return None
+
+def entity_column(Show, entity_type):
+  return Show.venue_id if entity_type == 'venue' else Show.artist_id
+
+def chunks(ids, size=REFRESH_CHUNK_SIZE):
+  ids = list(ids)
+  for start in range(0, len(ids), size):
+    yield ids[start:start + size]
+
+# SELECT of the show_stats rows of the given entities, in show_stats column order, computed from
+# their shows. ids None selects the rows of every entity with shows.
+def aggregate_shows(Show, entity_type, ids, now):
+  entity_id = entity_column(Show, entity_type)
+  upcoming = Show.start_time > now
+  query = select(literal(entity_type).label('entity_type'), entity_id.label('entity_id'),
+                 func.sum(case((upcoming, 1), else_=0)).label('upcoming_count'),
+                 func.sum(case((upcoming, 0), else_=1)).label('past_count'),
+                 func.min(case((upcoming, Show.start_time))).label('next_show_time'),
+                 func.max(case((Show.start_time <= now, Show.start_time))).label('last_show_time'))
+  # sqlite needs a WHERE clause to tell an INSERT ... SELECT from its ON CONFLICT clause
+  query = query.where(entity_id.in_(ids) if ids is not None else true())
+  return query.group_by(entity_id)
+
+# Recomputes the rows of the given entities from their shows, in the transaction of connection.
+# Rows of entities left without shows are removed. ids None recomputes every row of entity_type.
+def refresh_show_stats(connection, Show, Show_Stats, entity_type, ids, now):
+  table = Show_Stats.__table__
+  columns = [column.name for column in table.columns]
+  for chunk in (chunks(ids) if ids is not None else [None]):
+    removed = delete(table).where(table.c.entity_type == entity_type)
+    if chunk is not None:
+      removed = removed.where(table.c.entity_id.in_(chunk))
+    connection.execute(removed)
+    insert = on_conflict_insert(connection.dialect.name, table)
+    if insert is None:
+      connection.execute(table.insert().from_select(columns, aggregate_shows(Show, entity_type, chunk, now)))
+      continue
+    # a show created by a concurrent transaction may have inserted the row since it was deleted
+    insert = insert.from_select(columns, aggregate_shows(Show, entity_type, chunk, now))
+    connection.execute(insert.on_conflict_do_update(
+      index_elements=[table.c.entity_type, table.c.entity_id],
+      set_=dict((name, insert.excluded[name]) for name in columns[2:])))
+
+def rebuild_show_stats(connection, Show, Show_Stats, now):
+  for entity_type in ('venue', 'artist'):
+    refresh_show_stats(connection, Show, Show_Stats, entity_type, None, now)
+
+# Counts a new show in the rows of its venue and artist with a single upsert each, in the
+# transaction inserting the show. Databases without upserts recompute the rows instead.
+def record_show_added(connection, Show, Show_Stats, show, now):
+  table = Show_Stats.__table__
+  upcoming = show.start_time > now
+  for entity_type, entity_id in (('venue', show.venue_id), ('artist', show.artist_id)):
+    insert = on_conflict_insert(connection.dialect.name, table)
+    if insert is None:
+      refresh_show_stats(connection, Show, Show_Stats, entity_type, [entity_id], now)
+      continue
+    insert = insert.values(entity_type=entity_type, entity_id=entity_id,
+                           upcoming_count=1 if upcoming else 0, past_count=0 if upcoming else 1,
+                           next_show_time=show.start_time if upcoming else None,
+                           last_show_time=None if upcoming else show.start_time)
+    if upcoming:
+      changes = {
+        'upcoming_count': table.c.upcoming_count + 1,
+        'next_show_time': case((or_(table.c.next_show_time.is_(None), table.c.next_show_time > show.start_time),
+                                show.start_time), else_=table.c.next_show_time),
+      }
+    else:
+      changes = {
+        'past_count': table.c.past_count + 1,
+        'last_show_time': case((or_(table.c.last_show_time.is_(None), table.c.last_show_time < show.start_time),
+                                show.start_time), else_=table.c.last_show_time),
+      }
+    connection.execute(insert.on_conflict_do_update(index_elements=[table.c.entity_type, table.c.entity_id],
+                                                    set_=changes))
+
+# A removed show may have been the next or last one of its venue/artist, recompute both rows
+def record_show_removed(connection, Show, Show_Stats, show, now):
+  refresh_show_stats(connection, Show, Show_Stats, 'venue', [show.venue_id], now)
+  refresh_show_stats(connection, Show, Show_Stats, 'artist', [show.artist_id], now)
+
+# Returns {entity_id: row} of the given entities, computed from their shows without writing
+def compute_show_stats(session, Show, entity_type, ids, now):
+  stats = {}
+  for chunk in chunks(ids):
+    for row in session.execute(aggregate_shows(Show, entity_type, chunk, now)):
+      stats[row.entity_id] = row
+  return stats
+
+def is_stale(row, now):
+  return row.next_show_time is not None and row.next_show_time <= now
+
+# Returns {entity_id: row} of the stored statistics of the given entities, entities without shows
+# are left out. Rows have the upcoming_count, past_count, next_show_time and last_show_time of the
+# entity. Stale rows are recomputed in memory, reads may run on a replica and never write.
+def get_show_stats(session, Show, Show_Stats, entity_type, ids, now):
+  table = Show_Stats.__table__
+  stats = {}
+  for chunk in chunks(ids):
+    rows = session.execute(select(table).where(table.c.entity_type == entity_type)
+                                        .where(table.c.entity_id.in_(chunk)))
+    for row in rows:
+      stats[row.entity_id] = row
+  stale = [entity_id for entity_id, row in stats.items() if is_stale(row, now)]
+  if len(stale) > 0:
+    fresh = compute_show_stats(session, Show, entity_type, stale, now)
+    for entity_id in stale:
+      if entity_id in fresh:
+        stats[entity_id] = fresh[entity_id]
+      else:
+        del stats[entity_id]
+  return stats
+
+# Recomputes the stale rows, moving the shows that started since they were written from upcoming
+# to past, and returns how many entities were refreshed
+def roll_show_stats(connection, Show, Show_Stats, now):
+  table = Show_Stats.__table__
+  stale = connection.execute(select(table.c.entity_type, table.c.entity_id)
+                             .where(table.c.next_show_time <= now)).all()
+  for entity_type in ('venue', 'artist'):
+    ids = [entity_id for stale_type, entity_id in stale if stale_type == entity_type]
+    if len(ids) > 0:
+      refresh_show_stats(connection, Show, Show_Stats, entity_type, ids, now)
+  return len(stale)
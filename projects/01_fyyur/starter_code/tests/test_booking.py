@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta, timezone
+
+from booking import BookingIndex
+
+DURATION = timedelta(minutes=120)
+START = datetime(2030, 1, 1, 20, tzinfo=timezone.utc)
+
+
+def booked(*shows):
+  index = BookingIndex(DURATION)
+  for show in shows:
+    index.add(*show)
+  return index
+
+
+def test_no_conflict_without_shows():
+  assert booked().conflict('venue', 'artist', START) is None
+
+
+def test_overlapping_show_of_the_venue_conflicts():
+  conflict = booked(('venue', 'other artist', START)).conflict('venue', 'artist', START + timedelta(minutes=90))
+  assert conflict.entity_type == 'venue'
+  assert conflict.start_time == START
+
+
+def test_overlapping_show_of_the_artist_conflicts():
+  conflict = booked(('other venue', 'artist', START)).conflict('venue', 'artist', START - timedelta(minutes=30))
+  assert conflict.entity_type == 'artist'
+
+
+def test_shows_a_duration_apart_do_not_conflict():
+  index = booked(('venue', 'artist', START))
+  assert index.conflict('venue', 'artist', START + DURATION) is None
+  assert index.conflict('venue', 'artist', START - DURATION) is None
+
+
+def test_other_venues_and_artists_do_not_conflict():
+  assert booked(('venue', 'artist', START)).conflict('other venue', 'other artist', START) is None
+
+
+def test_contains_exact_shows():
+  index = booked(('venue', 'artist', START))
+  assert ('venue', 'artist', START) in index
+  assert ('venue', 'artist', START + DURATION) not in index
@@ -0,0 +1,72 @@
+import time
+
+import fakeredis
+import pytest
+
+from cache import LRUCache, RedisCache, versioned_key
+
+
+@pytest.fixture(params=['lru', 'redis'])
+def cache(request):
+  if request.param == 'lru':
+    return LRUCache(max_size=3)
+  return RedisCache(fakeredis.FakeStrictRedis(), key_prefix='test:')
+
+
+def test_get_set_delete(cache):
+  assert cache.get('missing', 'default') == 'default'
+  cache.set('key', {'value': 1})
+  assert cache.get('key') == {'value': 1}
+  cache.delete('key')
+  assert cache.get('key') is None
+  assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_entries_expire(cache):
+  cache.set('key', 'value', ttl=1)
+  assert cache.get('key') == 'value'
+  time.sleep(1.1)
+  assert cache.get('key') is None
+
+
+def test_bumping_a_namespace_changes_its_keys(cache):
+  key = versioned_key(cache, ['venue', 'show'], 'view', '/venues')
+  cache.set(key, 'page')
+  assert versioned_key(cache, ['venue', 'show'], 'view', '/venues') == key
+  cache.bump_version('show')
+  new_key = versioned_key(cache, ['venue', 'show'], 'view', '/venues')
+  assert new_key != key
+  assert cache.get(new_key) is None
+  # other namespaces keep their version
+  assert versioned_key(cache, ['venue'], 'view') == versioned_key(cache, ['venue'], 'view')
+
+
+def test_clear_keeps_versions(cache):
+  cache.bump_version('venue')
+  version = cache.version('venue')
+  cache.set('key', 'value')
+  cache.clear()
+  assert cache.get('key') is None
+  assert cache.version('venue') == version
+
+
+def test_bumped_within(cache):
+  assert not cache.bumped_within(['venue'], 60)
+  cache.bump_version('venue')
+  assert cache.bumped_within(['artist', 'venue'], 60)
+  assert not cache.bumped_within(['artist'], 60)
+  assert not cache.bumped_within([], 60)
+
+
+def test_lru_evicts_least_recently_used():
+  cache = LRUCache(max_size=2)
+  cache.set('a', 1)
+  cache.set('b', 2)
+  cache.get('a')
+  cache.set('c', 3)
+  assert cache.get('b') is None
+  assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_lru_versions_differ_between_processes():
+  assert LRUCache().version('venue') != LRUCache().version('venue')
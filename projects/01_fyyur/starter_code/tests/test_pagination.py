@@ -0,0 +1,67 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import Column, MetaData, String, Table, create_engine
+from sqlalchemy.orm import Session
+
+from database import GUID, UTCDateTime
+from helper_functions import cursor_sort_values, encode_cursor, paginate_keyset
+
+metadata = MetaData()
+items = Table('item', metadata,
+              Column('id', GUID, primary_key=True),
+              Column('name', String, nullable=True),
+              Column('start_time', UTCDateTime, nullable=False))
+
+ID = str(uuid.uuid4())
+
+
+@pytest.mark.parametrize('values, expected', [
+  (['Hop', '2030-01-01T20:00:00+00:00', ID.upper()], ['Hop', datetime(2030, 1, 1, 20, tzinfo=timezone.utc), ID]),
+  ([None, '2030-01-01T20:00:00+00:00', ID], [None, datetime(2030, 1, 1, 20, tzinfo=timezone.utc), ID]),
+])
+def test_cursor_sort_values_converts_values(values, expected):
+  assert cursor_sort_values([items.c.name, items.c.start_time, items.c.id], values) == expected
+
+
+@pytest.mark.parametrize('values', [
+  None,
+  ['Hop', '2030-01-01T20:00:00'],
+  [1, '2030-01-01T20:00:00', ID],
+  ['Hop', 'not a time', ID],
+  ['Hop', None, ID],
+  ['Hop', '2030-01-01T20:00:00', 'not-a-uuid'],
+  ['Hop', '2030-01-01T20:00:00', None],
+  ['Hop', '2030-01-01T20:00:00', {'id': ID}],
+])
+def test_cursor_sort_values_rejects_values_not_fitting_the_columns(values):
+  assert cursor_sort_values([items.c.name, items.c.start_time, items.c.id], values) is None
+
+
+def test_paginate_keyset_pages_through_nulls():
+  engine = create_engine('sqlite://')
+  metadata.create_all(engine)
+  names = ['b', None, 'a', None, 'c']
+  with engine.begin() as connection:
+    connection.execute(items.insert(), [{'id': str(uuid.UUID(int=number)), 'name': name,
+                                         'start_time': datetime(2030, 1, 1, tzinfo=timezone.utc)}
+                                        for number, name in enumerate(names)])
+  session = Session(engine)
+  seen = []
+  cursor = None
+  while True:
+    rows, cursor = paginate_keyset(session.query(items.c.id, items.c.name), [items.c.name, items.c.id], cursor, 2)
+    seen.extend(row.name for row in rows)
+    if cursor is None:
+      break
+  assert seen == ['a', 'b', 'c', None, None]
+
+
+def test_paginate_keyset_ignores_bad_cursors():
+  engine = create_engine('sqlite://')
+  metadata.create_all(engine)
+  session = Session(engine)
+  rows, cursor = paginate_keyset(session.query(items.c.id, items.c.name), [items.c.name, items.c.id],
+                                 encode_cursor([{'name': 1}, 'x']), 2)
+  assert rows == [] and cursor is None